@@ -0,0 +1,58 @@
+"""Microbenchmark: vectorized get_mel_windows vs. the original per-frame loop in get_data.
+
+python scripts/bench_mel_windows.py --seconds 10 60 300
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from generate_batch import get_mel_windows
+
+
+def mel_windows_loop(orig_mel, num_frames, fps=25, syncnet_mel_step_size=16):
+    spec = orig_mel.copy()
+    indiv_mels = []
+    for i in range(num_frames):
+        start_frame_num = i-2
+        start_idx = int(80. * (start_frame_num / float(fps)))
+        end_idx = start_idx + syncnet_mel_step_size
+        seq = list(range(start_idx, end_idx))
+        seq = [ min(max(item, 0), orig_mel.shape[0]-1) for item in seq ]
+        m = spec[seq, :]
+        indiv_mels.append(m.T)
+    return np.asarray(indiv_mels)
+
+
+def best_of(fn, repeat, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--seconds', nargs='+', type=float, default=[10, 60, 300], help='clip lengths to benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    fps = 25
+    for seconds in args.seconds:
+        num_frames = int(seconds * fps)
+        # 16kHz audio with hop 200 -> 80 mel frames per second
+        orig_mel = np.random.rand(int(seconds * 80) + 1, 80).astype(np.float32)
+
+        t_loop, ref = best_of(mel_windows_loop, args.repeat, orig_mel, num_frames, fps)
+        t_vec, out = best_of(get_mel_windows, args.repeat, orig_mel, num_frames, fps)
+
+        assert out.shape == ref.shape == (num_frames, 80, 16), (out.shape, ref.shape)
+        assert np.array_equal(out, ref), 'vectorized windows differ from the loop'
+        print(f'{seconds:>6.0f}s / {num_frames:>5} frames: loop {t_loop * 1e3:8.2f} ms   '
+              f'vectorized {t_vec * 1e3:7.2f} ms   speedup {t_loop / t_vec:6.1f}x')
@@ -0,0 +1,87 @@
+"""Benchmark: PasteBack (feathered blend + one low-res color correction) vs. per-frame seamlessClone.
+
+Reports ms/frame for each engine and the PSNR of the fast output against the seamlessClone
+output, on a synthetic picture or on --image with a centered crop box.
+
+python scripts/bench_paste_back.py --frames 50 --size 1920x1080 --crop 512
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.paste_pic import PasteBack, seamless_paste
+
+
+def synthetic_picture(width, height, seed=0):
+    # smooth gradients plus low-frequency noise, so blending seams are visible in the PSNR
+    rng = np.random.default_rng(seed)
+    noise = cv2.resize(rng.random((height // 32 + 1, width // 32 + 1, 3), dtype=np.float32), (width, height), interpolation=cv2.INTER_CUBIC)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([xs / width, ys / height, 1 - xs / width], axis=-1) * 160 + noise * 90
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def crop_frames(full_img, box, size, count, seed=1):
+    # the rendered crop: the same region, rescaled, slightly recolored and moving a little per frame
+    ox1, oy1, ox2, oy2 = box
+    region = cv2.resize(full_img[oy1:oy2, ox1:ox2], (size, size))
+    shifted = np.clip(region.astype(np.int16) + 12, 0, 255).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        m = np.float32([[1, 0, 3 * np.sin(i / 5)], [0, 1, 2 * np.cos(i / 7)]])
+        frames.append(cv2.warpAffine(shifted, m, (size, size), borderMode=cv2.BORDER_REFLECT))
+    return frames
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def run(paste, frames):
+    start = time.perf_counter()
+    out = [paste(frame) for frame in frames]
+    return (time.perf_counter() - start) / len(frames), out
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--image', default=None, help='full picture to paste into (default: synthetic)')
+    parser.add_argument('--size', default='1920x1080', help='synthetic picture size WxH')
+    parser.add_argument('--crop', type=int, default=512, help='side of the centered crop box in the picture')
+    parser.add_argument('--render', type=int, default=256, help='side of the rendered crop frames')
+    parser.add_argument('--frames', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.image:
+        full_img = cv2.imread(args.image)
+    else:
+        full_img = synthetic_picture(*map(int, args.size.split('x')))
+    h, w = full_img.shape[:2]
+    side = min(args.crop, h - 4, w - 4)
+    box = ((w - side) // 2, (h - side) // 2, (w + side) // 2, (h + side) // 2)
+    frames = crop_frames(full_img, box, args.render, args.frames)
+
+    t_seamless, ref = run(seamless_paste(full_img, box), frames)
+
+    fast = PasteBack(full_img, box)
+    t_plain, plain = run(fast, frames)
+    start = time.perf_counter()
+    fast.calibrate(frames[0])
+    t_calibrate = time.perf_counter() - start
+    t_fast, out = run(fast, frames)
+
+    region = (slice(box[1], box[3]), slice(box[0], box[2]))
+    print(f'{w}x{h} picture, {side}px box, {args.frames} frames of {args.render}px')
+    print(f'seamlessClone        {t_seamless * 1e3:8.2f} ms/frame')
+    print(f'feather              {t_plain * 1e3:8.2f} ms/frame   speedup {t_seamless / t_plain:6.1f}x   '
+          f'PSNR {np.mean([psnr(a[region], b[region]) for a, b in zip(plain, ref)]):6.2f} dB')
+    print(f'feather + color fix  {t_fast * 1e3:8.2f} ms/frame   speedup {t_seamless / t_fast:6.1f}x   '
+          f'PSNR {np.mean([psnr(a[region], b[region]) for a, b in zip(out, ref)]):6.2f} dB   '
+          f'(calibration {t_calibrate * 1e3:.1f} ms once)')
@@ -13,19 +13,19 @@ from torch.multiprocessing import Pool, Process, set_start_method
 from facexlib.alignment import landmark_98_to_68
 from facexlib.detection import init_detection_model
 
-from facexlib.utils import load_file_from_url
 from face3d.util.my_awing_arch import FAN
+from utils.weights import get_weight_registry, load_torch
 
-def init_alignment_model(model_name, half=False, device='cuda', model_rootpath=None):
+def init_alignment_model(model_name, half=False, device='cuda', model_path=None):
     if model_name == 'awing_fan':
         model = FAN(num_modules=4, num_landmarks=98, device=device)
-        model_url = 'https://github.com/xinntao/facexlib/releases/download/v0.1.0/alignment_WFLW_4HG.pth'
+        registry_name = 'alignment_WFLW_4HG'
     else:
         raise NotImplementedError(f'{model_name} is not implemented.')
 
-    model_path = load_file_from_url(
-        url=model_url, model_dir='facexlib/weights', progress=True, file_name=None, save_dir=model_rootpath)
-    model.load_state_dict(torch.load(model_path, map_location=device)['state_dict'], strict=True)
+    # resolved from the local weight registry; never downloaded at runtime
+    model_path = model_path or get_weight_registry().resolve(registry_name)
+    model.load_state_dict(load_torch(model_path, map_location=device)['state_dict'], strict=True)
     model.eval()
     model = model.to(device)
     return model
@@ -34,34 +34,15 @@ def init_alignment_model(model_name, half=False, device='cuda', model_rootpath=N
 class KeypointExtractor():
     def __init__(self, device='cuda'):
 
-        ### gfpgan/weights
-        try:
-            import webui  # in webui
-            root_path = 'extensions/SadTalker/gfpgan/weights' 
+        weights = get_weight_registry().require(['alignment_WFLW_4HG', 'detection_Resnet50_Final'])
+        self.detector = init_alignment_model('awing_fan', device=device, model_path=weights['alignment_WFLW_4HG'])
+        # facexlib only downloads when the file is not already in model_rootpath
+        self.det_net = init_detection_model('retinaface_resnet50', half=False, device=device,
+                                            model_rootpath=os.path.dirname(weights['detection_Resnet50_Final']))
 
-        except:
-            root_path = 'gfpgan/weights'
-
-        self.detector = init_alignment_model('awing_fan',device=device, model_rootpath=root_path)   
-        self.det_net = init_detection_model('retinaface_resnet50', half=False,device=device, model_rootpath=root_path)
-
-    def extract_keypoint(self, images, name=None, info=True):
+    def extract_keypoint(self, images, name=None, info=True, batch_size=16):
         if isinstance(images, list):
-            keypoints = []
-            if info:
-                i_range = tqdm(images,desc='landmark Det:')
-            else:
-                i_range = images
-
-            for image in i_range:
-                current_kp = self.extract_keypoint(image)
-                # current_kp = self.detector.get_landmarks(np.array(image))
-                if np.mean(current_kp) == -1 and keypoints:
-                    keypoints.append(keypoints[-1])
-                else:
-                    keypoints.append(current_kp[None])
-
-            keypoints = np.concatenate(keypoints, 0)
+            keypoints = self.extract_keypoint_batch(images, batch_size=batch_size, info=info)
             np.savetxt(os.path.splitext(name)[0]+'.txt', keypoints.reshape(-1))
             return keypoints
         else:
@@ -98,6 +79,88 @@ class KeypointExtractor():
                 np.savetxt(os.path.splitext(name)[0]+'.txt', keypoints.reshape(-1))
             return keypoints
 
+    def _detect(self, images):
+        """ First face box (x1, y1, x2, y2) of every image, or None; one batched pass when facexlib has it. """
+        with torch.no_grad():
+            # facexlib's batched path takes equally sized PIL frames (converted to BGR internally)
+            if len(images) > 1 and hasattr(self.det_net, 'batched_detect_faces') \
+                    and all(isinstance(image, Image.Image) for image in images):
+                dets, _ = self.det_net.batched_detect_faces(images, 0.97)
+            else:
+                dets = [self.det_net.detect_faces(image, 0.97) for image in images]
+        return [tuple(max(0, int(v)) for v in det[0][:4]) if len(det) else None for det in dets]
+
+    def _landmarks(self, frames, boxes):
+        """ 68 landmarks of every frame inside its box, all crops through FAN as one batch. """
+        crops = [frame[y1:y2, x1:x2, :] for frame, (x1, y1, x2, y2) in zip(frames, boxes)]
+        with torch.no_grad():
+            lms = self.detector.get_landmarks_batch(crops)
+        keypoints = []
+        for lm, (x1, y1, _, _) in zip(lms, boxes):
+            lm = landmark_98_to_68(lm)
+            lm[:, 0] += x1
+            lm[:, 1] += y1
+            keypoints.append(lm)
+        return keypoints
+
+    @staticmethod
+    def _layout(keypoints, box):
+        """ Landmark extent relative to the face box, used to tell when a tracked box has drifted. """
+        x1, y1, x2, y2 = box
+        w, h = max(x2 - x1, 1), max(y2 - y1, 1)
+        return np.array([(keypoints[:, 0].min() - x1) / w, (keypoints[:, 1].min() - y1) / h,
+                         (keypoints[:, 0].max() - x1) / w, (keypoints[:, 1].max() - y1) / h])
+
+    def extract_keypoint_batch(self, images, batch_size=16, info=True, drift_tol=0.1):
+        """
+        Landmarks of a frame sequence, (n, 68, 2). The face box found on one frame is reused for
+        the following ones, and RetinaFace only runs again (batched) on frames whose landmarks
+        have drifted more than drift_tol of the box from where they sat when it was detected.
+        FAN sees each batch of crops as a single tensor. As in the per-image path, a frame
+        without a face repeats the previous landmarks (or is -1 if there are none yet).
+        """
+        frames = [np.array(image) for image in images]
+        keypoints = np.empty((len(frames), 68, 2), dtype=np.float64)
+        box, ref = None, None
+        redetected = 0
+
+        starts = range(0, len(frames), batch_size)
+        for start in (tqdm(starts, desc='landmark Det:') if info else starts):
+            idx = list(range(start, min(start + batch_size, len(frames))))
+            found = {}
+
+            if box is not None:
+                for i, lm in zip(idx, self._landmarks([frames[i] for i in idx], [box] * len(idx))):
+                    if np.abs(self._layout(lm, box) - ref).max() <= drift_tol:
+                        found[i] = lm
+            lost = [i for i in idx if i not in found]
+            redetected += len(lost)
+
+            if lost:
+                boxes = self._detect([images[i] for i in lost])
+                hits = [(i, b) for i, b in zip(lost, boxes) if b is not None]
+                if hits:
+                    lms = self._landmarks([frames[i] for i, _ in hits], [b for _, b in hits])
+                    for (i, b), lm in zip(hits, lms):
+                        found[i] = lm
+                    # keep tracking from the latest detection
+                    (_, box), lm = hits[-1], lms[-1]
+                    ref = self._layout(lm, box)
+                if boxes[-1] is None and lost[-1] == idx[-1]:
+                    box, ref = None, None
+
+            for i in idx:
+                if i in found:
+                    keypoints[i] = found[i]
+                elif i > 0:
+                    keypoints[i] = keypoints[i - 1]
+                else:
+                    keypoints[i] = -1.
+
+        if info:
+            print(f'landmark Det: face detector ran on {redetected}/{len(frames)} frames')
+        return keypoints
+
 def read_video(filename):
     frames = []
     cap = cv2.VideoCapture(filename)
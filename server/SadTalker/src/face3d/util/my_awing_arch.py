@@ -376,3 +376,22 @@ class FAN(nn.Module):
         pred += offset[-2:]
 
         return pred
+
+    def get_landmarks_batch(self, imgs):
+        """ get_landmarks for a list of face crops with a single forward pass; returns (n, 98, 2). """
+        inps, offsets = [], []
+        for img in imgs:
+            H, W, _ = img.shape
+            offsets.append((W / 64, H / 64))
+            inps.append(cv2.resize(img, (256, 256))[..., ::-1].transpose((2, 0, 1)))
+        inp = torch.from_numpy(np.ascontiguousarray(np.stack(inps))).float()
+        inp = inp.to(self.device)
+        inp.div_(255.0)
+
+        outputs, _ = self.forward(inp)
+        heatmaps = outputs[-1][:, :-1, :, :].detach().cpu().numpy()
+
+        # calculate_points couples its edge handling across the batch, so decode each face on its own
+        preds = np.stack([calculate_points(heatmaps[i:i + 1]).reshape(-1, 2) for i in range(len(imgs))])
+        preds *= np.asarray(offsets, dtype=preds.dtype)[:, None, :]
+        return preds
@@ -3,13 +3,8 @@ import cv2
 import yaml
 import numpy as np
 import warnings
-from skimage import img_as_ubyte
-import safetensors
-import safetensors.torch 
 warnings.filterwarnings('ignore')
 
-import imageio_ffmpeg
-import imageio
 import torch
 import torchvision
 import re
@@ -18,12 +13,12 @@ import re
 from facerender.modules.keypoint_detector import HEEstimator, KPDetector
 from facerender.modules.mapping import MappingNet
 from facerender.modules.generator import OcclusionAwareGenerator, OcclusionAwareSPADEGenerator
-from facerender.modules.make_animation import make_animation 
+from facerender.modules.make_animation import iter_animation, SourceFeatureCache
 
-from pydub import AudioSegment 
 from utils.face_enhancer import enhancer_generator_with_len, enhancer_list
 from utils.paste_pic import paste_pic
-from utils.videoio import save_video_with_watermark
+from utils.videoio import FFmpegWriter
+from utils.weights import load_safetensors, load_torch
 
 try:
     import webui  # in webui
@@ -83,31 +78,20 @@ class AnimateFromCoeff():
         self.mapping.eval()
          
         self.device = device
+        # source-side features per avatar, reused across requests while this instance is pooled
+        self.source_cache = SourceFeatureCache()
     
     def load_cpk_facevid2vid_safetensor(self, checkpoint_path, generator=None, 
                         kp_detector=None, he_estimator=None,  
                         device="cpu"):
 
-        checkpoint = safetensors.torch.load_file(checkpoint_path)
-
+        # each module reads only its own tensors from the memory-mapped file
         if generator is not None:
-            x_generator = {}
-            for k,v in checkpoint.items():
-                if 'generator' in k:
-                    x_generator[k.replace('generator.', '')] = v
-            generator.load_state_dict(x_generator)
+            generator.load_state_dict(load_safetensors(checkpoint_path, 'generator'))
         if kp_detector is not None:
-            x_generator = {}
-            for k,v in checkpoint.items():
-                if 'kp_extractor' in k:
-                    x_generator[k.replace('kp_extractor.', '')] = v
-            kp_detector.load_state_dict(x_generator)
+            kp_detector.load_state_dict(load_safetensors(checkpoint_path, 'kp_extractor'))
         if he_estimator is not None:
-            x_generator = {}
-            for k,v in checkpoint.items():
-                if 'he_estimator' in k:
-                    x_generator[k.replace('he_estimator.', '')] = v
-            he_estimator.load_state_dict(x_generator)
+            he_estimator.load_state_dict(load_safetensors(checkpoint_path, 'he_estimator'))
         
         return None
 
@@ -115,7 +99,7 @@ class AnimateFromCoeff():
                         kp_detector=None, he_estimator=None, optimizer_generator=None, 
                         optimizer_discriminator=None, optimizer_kp_detector=None, 
                         optimizer_he_estimator=None, device="cpu"):
-        checkpoint = torch.load(checkpoint_path, map_location=torch.device(device))
+        checkpoint = load_torch(checkpoint_path, map_location=torch.device(device))
         if generator is not None:
             generator.load_state_dict(checkpoint['generator'])
         if kp_detector is not None:
@@ -143,7 +127,7 @@ class AnimateFromCoeff():
     
     def load_cpk_mapping(self, checkpoint_path, mapping=None, discriminator=None,
                  optimizer_mapping=None, optimizer_discriminator=None, device='cpu'):
-        checkpoint = torch.load(checkpoint_path,  map_location=torch.device(device))
+        checkpoint = load_torch(checkpoint_path, map_location=torch.device(device))
         if mapping is not None:
             mapping.load_state_dict(checkpoint['mapping'])
         if discriminator is not None:
@@ -155,11 +139,53 @@ class AnimateFromCoeff():
 
         return checkpoint['epoch']
 
-    def generate(self, x, video_save_dir, pic_path, crop_info, enhancer=None, background_enhancer=None, preprocess='crop', img_size=256):
+    @staticmethod
+    def _iter_frames(chunks, frame_num, out_size=None):
+        """
+        Turn (1, n, 3, H, W) render chunks, already in video order, into uint8 (H, W, 3)
+        frames, stopping (and so rendering nothing more) after frame_num frames.
+        """
+        count = 0
+        for chunk in chunks:
+            # same rounding as img_as_ubyte, done on the device before the copy to host
+            chunk = (chunk * 255).round_().clamp_(0, 255).to(torch.uint8).permute(0, 1, 3, 4, 2).cpu().numpy()
+            for image in chunk[0]:
+                if count >= frame_num:
+                    return
+                count += 1
+                yield cv2.resize(image, out_size) if out_size else image
+
+    def _iter_streams(self, source_image, source_semantics, target_semantics, yaw_c_seq, pitch_c_seq, roll_c_seq, chunk_size):
+        """
+        Render chunks of every batch stream, one stream after the other. Stream b holds frames
+        [b * frames_per_stream, (b + 1) * frames_per_stream) of the video, so rendering the
+        streams in turn yields the video in order and no frame has to be held back.
+        """
+        def stream(seq, b):
+            if seq is None or isinstance(seq, torch.Tensor):
+                return None if seq is None else seq[b:b + 1]
+            return seq.stream(b)  # lazy SemanticWindows view
+
+        for b in range(source_image.shape[0]):
+            yield from iter_animation(source_image[b:b + 1], source_semantics[b:b + 1], stream(target_semantics, b),
+                                      self.generator, self.kp_extractor, self.he_estimator, self.mapping,
+                                      stream(yaw_c_seq, b), stream(pitch_c_seq, b), stream(roll_c_seq, b), use_exp=True,
+                                      chunk_size=chunk_size, source_cache=self.source_cache)
+
+    @staticmethod
+    def _write_video(frames, save_path, audio_path, duration):
+        with FFmpegWriter(save_path, fps=25, audio_path=audio_path, duration=duration) as writer:
+            for frame in frames:
+                writer.write(frame)
+
+    def generate(self, x, video_save_dir, pic_path, crop_info, enhancer=None, background_enhancer=None, preprocess='crop', img_size=256, render_chunk_size=1, scene=None):
 
         source_image=x['source_image'].type(torch.FloatTensor)
         source_semantics=x['source_semantics'].type(torch.FloatTensor)
-        target_semantics=x['target_semantics_list'].type(torch.FloatTensor) 
+        target_semantics=x['target_semantics_list']
+        if isinstance(target_semantics, torch.Tensor):
+            target_semantics=target_semantics.type(torch.FloatTensor)
+        # otherwise a lazy SemanticWindows view, gathered chunk by chunk inside iter_animation
         source_image=source_image.to(self.device)
         source_semantics=source_semantics.to(self.device)
         target_semantics=target_semantics.to(self.device)
@@ -181,80 +207,64 @@ class AnimateFromCoeff():
 
         frame_num = x['frame_num']
 
-        predictions_video = make_animation(source_image, source_semantics, target_semantics,
-                                        self.generator, self.kp_extractor, self.he_estimator, self.mapping, 
-                                        yaw_c_seq, pitch_c_seq, roll_c_seq, use_exp = True)
-
-        predictions_video = predictions_video.reshape((-1,)+predictions_video.shape[2:])
-        predictions_video = predictions_video[:frame_num]
-
-        video = []
-        for idx in range(predictions_video.shape[0]):
-            image = predictions_video[idx]
-            image = np.transpose(image.data.cpu().numpy(), [1, 2, 0]).astype(np.float32)
-            video.append(image)
-        result = img_as_ubyte(video)
+        chunks = self._iter_streams(source_image, source_semantics, target_semantics,
+                                    yaw_c_seq, pitch_c_seq, roll_c_seq, render_chunk_size)
 
         ### keep aspect ratio
         original_size = crop_info[0]
-        if original_size:
-            result = [ cv2.resize(result_i,(img_size, int(img_size * original_size[1]/original_size[0]) )) for result_i in result ]
+        out_size = (img_size, int(img_size * original_size[1]/original_size[0])) if original_size else None
         
         # --- FIX: sanitize video_name to avoid bad chars (##, spaces, etc.)
         raw_name = x['video_name']
         safe_name = re.sub(r'[^a-zA-Z0-9_\-\.]', '_', raw_name)
 
         video_name = safe_name + '.mp4'
-        path = os.path.join(video_save_dir, 'temp_'+video_name)
-        
-        imageio.mimsave(path, result, fps=25, codec="libx264", format="ffmpeg")
-
         av_path = os.path.join(video_save_dir, video_name)
         return_path = av_path 
         
         audio_path =  x['audio_path'] 
-        audio_name = os.path.splitext(os.path.split(audio_path)[-1])[0]
-        new_audio_path = os.path.join(video_save_dir, audio_name+'.wav')
-        start_time = 0
-        # cog will not keep the .mp3 filename
-        sound = AudioSegment.from_file(audio_path)
-        frames = frame_num 
-        end_time = start_time + frames*1/25*1000
-        word1=sound.set_frame_rate(16000)
-        word = word1[start_time:end_time]
-        word.export(new_audio_path, format="wav")
-
-        save_video_with_watermark(path, new_audio_path, av_path, watermark= False)
+        # the audio is trimmed to the rendered frames and muxed by the same ffmpeg process
+        duration = frame_num / 25
+
+        frames_args = (chunks, frame_num)
+        if scene is not None:
+            # composite onto the scene in memory: speech, music and background leave in one encode
+            if 'full' in preprocess.lower() or enhancer:
+                raise ValueError('scene compositing needs crop/resize preprocessing without the enhancer')
+            scene.prepare(crop_info, out_size or (img_size, img_size))
+            with scene.writer(av_path, audio_path, duration, fps=25) as writer:
+                for frame in self._iter_frames(*frames_args):
+                    writer.write(scene.composite(frame))
+            print(f'The generated video is named {video_save_dir}/{video_name}') 
+            return return_path
+
+        # frames go to the encoder as they are rendered, so memory stays at one chunk
+        with FFmpegWriter(av_path, fps=25, audio_path=audio_path, duration=duration) as writer:
+            for frame in self._iter_frames(*frames_args, out_size):
+                writer.write(frame)
         print(f'The generated video is named {video_save_dir}/{video_name}') 
 
         if 'full' in preprocess.lower():
             video_name_full = safe_name + '_full.mp4'
             full_video_path = os.path.join(video_save_dir, video_name_full)
             return_path = full_video_path
-            paste_pic(path, pic_path, crop_info, new_audio_path, full_video_path, extended_crop= True if 'ext' in preprocess.lower() else False)
+            paste_pic(av_path, pic_path, crop_info, audio_path, full_video_path, extended_crop= True if 'ext' in preprocess.lower() else False, duration=duration)
             print(f'The generated video is named {video_save_dir}/{video_name_full}') 
         else:
             full_video_path = av_path 
 
         if enhancer:
             video_name_enhancer = safe_name + '_enhanced.mp4'
-            enhanced_path = os.path.join(video_save_dir, 'temp_'+video_name_enhancer)
             av_path_enhancer = os.path.join(video_save_dir, video_name_enhancer) 
             return_path = av_path_enhancer
 
             try:
-                enhanced_images_gen_with_len = enhancer_generator_with_len(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
-                imageio.mimsave(enhanced_path, enhanced_images_gen_with_len, fps=float(25))
+                enhanced_images = enhancer_generator_with_len(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
+                self._write_video(enhanced_images, av_path_enhancer, audio_path, duration)
             except:
-                enhanced_images_gen_with_len = enhancer_list(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
-                imageio.mimsave(enhanced_path, enhanced_images_gen_with_len, fps=float(25))
-            
-            save_video_with_watermark(enhanced_path, new_audio_path, av_path_enhancer, watermark= False)
+                enhanced_images = enhancer_list(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
+                self._write_video(enhanced_images, av_path_enhancer, audio_path, duration)
             print(f'The generated video is named {video_save_dir}/{video_name_enhancer}')
-            os.remove(enhanced_path)
-
-        os.remove(path)
-        os.remove(new_audio_path)
 
         return return_path
 
@@ -1,4 +1,7 @@
 from scipy.spatial import ConvexHull
+from collections import OrderedDict
+import hashlib
+import threading
 import torch
 import torch.nn.functional as F
 import numpy as np
@@ -99,44 +102,149 @@ def keypoint_transformation(kp_canonical, he, wo_exp=False):
 
 
 
-def make_animation(source_image, source_semantics, target_semantics,
+class SourceFeatureCache():
+    """
+    LRU cache of the source-side work for an avatar: generator feature volume,
+    canonical keypoints and source keypoints. Keyed by the source image and
+    source semantics contents, so repeat renders of the same avatar skip
+    kp_detector, mapping(source) and the generator encoder entirely.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source_image, source_semantics):
+        h = hashlib.sha1()
+        for t in (source_image, source_semantics):
+            t = t.detach().cpu().contiguous()
+            h.update(str(tuple(t.shape)).encode())
+            h.update(t.numpy().tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def encode_source(source_image, source_semantics, generator, kp_detector, mapping, source_cache=None):
+    """ Everything make_animation needs from the source side, computed once (or fetched from source_cache). """
+    key = None
+    if source_cache is not None:
+        key = source_cache.key(source_image, source_semantics)
+        entry = source_cache.get(key)
+        if entry is not None:
+            return entry
+
+    kp_canonical = kp_detector(source_image)
+    he_source = mapping(source_semantics)
+    kp_source = keypoint_transformation(kp_canonical, he_source)
+    entry = {
+        'feature_3d': generator.encode_source(source_image),
+        'kp_canonical': {'value': kp_canonical['value']},
+        'kp_source': kp_source,
+    }
+    if source_cache is not None:
+        source_cache.put(key, entry)
+    return entry
+
+def auto_chunk_size(source_image, max_chunk=32, memory_fraction=0.5):
+    """ Pick how many frames to render per forward pass from the memory currently available. """
+    size = source_image.shape[-1]
+    # peak activation footprint of one frame through dense motion + SPADE decoder, measured ~150MB at 256px
+    bytes_per_frame = 2400 * size * size
+    if source_image.is_cuda:
+        free, _ = torch.cuda.mem_get_info(source_image.device)
+    else:
+        import psutil
+        free = psutil.virtual_memory().available
+    chunk = int(free * memory_fraction // (bytes_per_frame * source_image.shape[0]))
+    return max(1, min(max_chunk, chunk))
+
+def _flatten_frames(x):
+    # (bs, n, ...) -> (bs*n, ...), batch-major so it matches repeat_interleave below
+    return x.reshape((-1,) + x.shape[2:])
+
+def iter_animation(source_image, source_semantics, target_semantics,
                             generator, kp_detector, he_estimator, mapping, 
                             yaw_c_seq=None, pitch_c_seq=None, roll_c_seq=None,
-                            use_exp=True, use_half=False):
+                            use_exp=True, use_half=False, chunk_size=1, source_cache=None):
+    """
+    Render target_semantics (bs, T, C, 27) chunk by chunk, yielding (bs, n, 3, H, W) frame
+    tensors as soon as each chunk is decoded. target_semantics may also be a lazy
+    SemanticWindows view; only [:, start:end] of it is ever materialized.
+
+    chunk_size frames of every stream are pushed through mapping, keypoint_transformation
+    and the generator in one forward pass; 'auto' sizes the chunk from free memory.
+    The source image is encoded once per call, or once per avatar with a SourceFeatureCache.
+    """
+    if chunk_size == 'auto':
+        chunk_size = auto_chunk_size(source_image)
+    chunk_size = max(1, int(chunk_size))
+
+    bs = source_image.shape[0]
     with torch.no_grad():
-        predictions = []
+        source = encode_source(source_image, source_semantics, generator, kp_detector, mapping, source_cache)
+    feature_3d, kp_canonical, kp_source = source['feature_3d'], source['kp_canonical'], source['kp_source']
 
-        kp_canonical = kp_detector(source_image)
-        he_source = mapping(source_semantics)
-        kp_source = keypoint_transformation(kp_canonical, he_source)
-    
-        for frame_idx in tqdm(range(target_semantics.shape[1]), 'Face Renderer:'):
-            # still check the dimension
-            # print(target_semantics.shape, source_semantics.shape)
-            target_semantics_frame = target_semantics[:, frame_idx]
-            he_driving = mapping(target_semantics_frame)
+    num_frames = target_semantics.shape[1]
+    for start in tqdm(range(0, num_frames, chunk_size), 'Face Renderer:'):
+        end = min(start + chunk_size, num_frames)
+        n = end - start
+
+        # no_grad per chunk: the caller runs between yields and must not inherit the grad mode
+        with torch.no_grad():
+            he_driving = mapping(_flatten_frames(target_semantics[:, start:end]))
             if yaw_c_seq is not None:
-                he_driving['yaw_in'] = yaw_c_seq[:, frame_idx]
+                he_driving['yaw_in'] = _flatten_frames(yaw_c_seq[:, start:end])
             if pitch_c_seq is not None:
-                he_driving['pitch_in'] = pitch_c_seq[:, frame_idx] 
+                he_driving['pitch_in'] = _flatten_frames(pitch_c_seq[:, start:end])
             if roll_c_seq is not None:
-                he_driving['roll_in'] = roll_c_seq[:, frame_idx] 
-            
-            kp_driving = keypoint_transformation(kp_canonical, he_driving)
-                
+                he_driving['roll_in'] = _flatten_frames(roll_c_seq[:, start:end])
+
+            kp_canonical_n = {'value': kp_canonical['value'].repeat_interleave(n, dim=0)}
+            kp_driving = keypoint_transformation(kp_canonical_n, he_driving)
+
             kp_norm = kp_driving
-            out = generator(source_image, kp_source=kp_source, kp_driving=kp_norm)
-            '''
-            source_image_new = out['prediction'].squeeze(1)
-            kp_canonical_new =  kp_detector(source_image_new)
-            he_source_new = he_estimator(source_image_new) 
-            kp_source_new = keypoint_transformation(kp_canonical_new, he_source_new, wo_exp=True)
-            kp_driving_new = keypoint_transformation(kp_canonical_new, he_driving, wo_exp=True)
-            out = generator(source_image_new, kp_source=kp_source_new, kp_driving=kp_driving_new)
-            '''
-            predictions.append(out['prediction'])
-        predictions_ts = torch.stack(predictions, dim=1)
-    return predictions_ts
+            out = generator.decode(feature_3d.repeat_interleave(n, dim=0),
+                                   kp_source={'value': kp_source['value'].repeat_interleave(n, dim=0)},
+                                   kp_driving=kp_norm)
+            prediction = out['prediction']
+        yield prediction.reshape((bs, n) + prediction.shape[1:])
+
+def make_animation(source_image, source_semantics, target_semantics,
+                            generator, kp_detector, he_estimator, mapping, 
+                            yaw_c_seq=None, pitch_c_seq=None, roll_c_seq=None,
+                            use_exp=True, use_half=False, chunk_size=1, source_cache=None):
+    """
+    Render target_semantics (bs, T, C, 27) into frames (bs, T, 3, H, W) held in memory at once.
+    See iter_animation for the streaming variant and the meaning of the arguments.
+    """
+    predictions = list(iter_animation(source_image, source_semantics, target_semantics,
+                                      generator, kp_detector, he_estimator, mapping,
+                                      yaw_c_seq, pitch_c_seq, roll_c_seq, use_exp=use_exp, use_half=use_half,
+                                      chunk_size=chunk_size, source_cache=source_cache))
+    return torch.cat(predictions, dim=1)
 
 class AnimateModel(torch.nn.Module):
     """
@@ -1,6 +1,5 @@
 import os
 
-from tqdm import tqdm
 import torch
 import numpy as np
 import random
@@ -22,6 +21,24 @@ def parse_audio_length(audio_length, sr, fps):
 
     return audio_length, num_frames
 
+def get_mel_windows(orig_mel, num_frames, fps=25, syncnet_mel_step_size=16):
+    """ (num_frames, 80, 16) mel windows, one per video frame, clamped at the clip edges.
+
+    Equivalent to slicing spec[start:start+16] per frame with out-of-range rows clamped, but done as
+    a single gather over a zero-copy sliding-window view of the edge-padded spectrogram.
+    """
+    frame_ids = np.arange(num_frames)
+    # same float expression as the per-frame version so int() truncation matches exactly
+    start_idx = (80. * ((frame_ids - 2) / float(fps))).astype(np.int64)
+    if num_frames == 0:
+        return np.zeros((0, orig_mel.shape[1], syncnet_mel_step_size), dtype=orig_mel.dtype)
+
+    pad_left = max(0, -int(start_idx.min()))
+    pad_right = max(0, int(start_idx.max()) + syncnet_mel_step_size - orig_mel.shape[0])
+    padded = np.pad(orig_mel, ((pad_left, pad_right), (0, 0)), mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, syncnet_mel_step_size, axis=0)   # n 80 16
+    return windows[start_idx + pad_left]
+
 def generate_blink_seq(num_frames):
     ratio = np.zeros((num_frames,1))
     frame_id = 0
@@ -64,19 +81,8 @@ def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, stil
         wav = audio.load_wav(audio_path, 16000) 
         wav_length, num_frames = parse_audio_length(len(wav), 16000, 25)
         wav = crop_pad_audio(wav, wav_length)
-        orig_mel = audio.melspectrogram(wav).T
-        spec = orig_mel.copy()         # nframes 80
-        indiv_mels = []
-
-        for i in tqdm(range(num_frames), 'mel:'):
-            start_frame_num = i-2
-            start_idx = int(80. * (start_frame_num / float(fps)))
-            end_idx = start_idx + syncnet_mel_step_size
-            seq = list(range(start_idx, end_idx))
-            seq = [ min(max(item, 0), orig_mel.shape[0]-1) for item in seq ]
-            m = spec[seq, :]
-            indiv_mels.append(m.T)
-        indiv_mels = np.asarray(indiv_mels)         # T 80 16
+        orig_mel = audio.melspectrogram(wav).T     # nframes 80
+        indiv_mels = get_mel_windows(orig_mel, num_frames, fps, syncnet_mel_step_size)         # T 80 16
 
     ratio = generate_blink_seq_randomly(num_frames)      # T
     source_semantics_path = first_coeff_path
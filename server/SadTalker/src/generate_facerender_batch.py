@@ -7,7 +7,8 @@ import scipy.io as scio
 
 def get_facerender_data(coeff_path, pic_path, first_coeff_path, audio_path, 
                         batch_size, input_yaw_list=None, input_pitch_list=None, input_roll_list=None, 
-                        expression_scale=1.0, still_mode = False, preprocess='crop', size = 256):
+                        expression_scale=1.0, still_mode = False, preprocess='crop', size = 256,
+                        lazy_semantics=False, debug_artifacts=False):
 
     semantic_radius = 13
     video_name = os.path.splitext(os.path.split(coeff_path)[-1])[0]
@@ -49,27 +50,17 @@ def get_facerender_data(coeff_path, pic_path, first_coeff_path, audio_path,
     if still_mode:
         generated_3dmm[:, 64:] = np.repeat(source_semantics[:, 64:], generated_3dmm.shape[0], axis=0)
 
-    with open(txt_path+'.txt', 'w') as f:
-        for coeff in generated_3dmm:
-            for i in coeff:
-                f.write(str(i)[:7]   + '  '+'\t')
-            f.write('\n')
+    if debug_artifacts:
+        # nothing downstream reads this back; it is only for inspecting a render
+        np.save(txt_path+'.npy', generated_3dmm.astype(np.float32))
 
-    target_semantics_list = [] 
     frame_num = generated_3dmm.shape[0]
     data['frame_num'] = frame_num
-    for frame_idx in range(frame_num):
-        target_semantics = transform_semantic_target(generated_3dmm, frame_idx, semantic_radius)
-        target_semantics_list.append(target_semantics)
-
-    remainder = frame_num%batch_size
-    if remainder!=0:
-        for _ in range(batch_size-remainder):
-            target_semantics_list.append(target_semantics)
-
-    target_semantics_np = np.array(target_semantics_list)             #frame_num 70 semantic_radius*2+1
-    target_semantics_np = target_semantics_np.reshape(batch_size, -1, target_semantics_np.shape[-2], target_semantics_np.shape[-1])
-    data['target_semantics_list'] = torch.FloatTensor(target_semantics_np)
+    semantic_windows = SemanticWindows(generated_3dmm, semantic_radius, batch_size)
+    if lazy_semantics:
+        data['target_semantics_list'] = semantic_windows
+    else:
+        data['target_semantics_list'] = semantic_windows.materialize()     #batch_size frame_num/batch_size 70 semantic_radius*2+1
     data['video_name'] = video_name
     data['audio_path'] = audio_path
     
@@ -90,6 +81,56 @@ def transform_semantic_1(semantic, semantic_radius):
     coeff_3dmm = np.concatenate(semantic_list, 0)
     return coeff_3dmm.transpose(1,0)
 
+class SemanticWindows():
+    """
+    Lazy (batch_size, frames_per_stream, C, 2*radius+1) view of the clamped semantic windows.
+
+    Only the coefficients and an index table are held, so memory stays O(frames * C) instead
+    of 27x that; a chunk is gathered when the renderer indexes [:, start:end].
+    The frame list is padded with the last frame up to a multiple of batch_size, like the eager version.
+    """
+
+    def __init__(self, coeff_3dmm, semantic_radius, batch_size, device='cpu'):
+        num_frames = coeff_3dmm.shape[0]
+        self.semantic_radius = semantic_radius
+        # edge padding reproduces the min/max clamping of transform_semantic_target
+        self.padded = np.pad(np.asarray(coeff_3dmm, dtype=np.float32), ((semantic_radius, semantic_radius), (0, 0)), mode='edge')
+        frame_ids = np.arange(num_frames)
+        remainder = num_frames % batch_size
+        if remainder != 0:
+            frame_ids = np.concatenate([frame_ids, np.full(batch_size - remainder, num_frames - 1)])
+        self.frame_ids = frame_ids.reshape(batch_size, -1)
+        self.device = device
+        self.shape = self.frame_ids.shape + (coeff_3dmm.shape[1], 2 * semantic_radius + 1)
+
+    def _windows(self):
+        # zero-copy: windows[i] == padded[i:i+2r+1].T == transform_semantic_target(coeff, i, r)
+        return np.lib.stride_tricks.sliding_window_view(self.padded, 2 * self.semantic_radius + 1, axis=0)
+
+    def to(self, device):
+        self.device = device
+        return self
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        frame_ids = self.frame_ids[index]
+        return torch.from_numpy(np.ascontiguousarray(self._windows()[frame_ids])).to(self.device)
+
+    def stream(self, index):
+        """ Lazy (1, frames_per_stream, C, 2*radius+1) view of one stream. """
+        view = SemanticWindows.__new__(SemanticWindows)
+        view.__dict__.update(self.__dict__)
+        view.frame_ids = self.frame_ids[index:index + 1]
+        view.shape = view.frame_ids.shape + self.shape[2:]
+        return view
+
+    def materialize(self):
+        return self[:, :]
+
 def transform_semantic_target(coeff_3dmm, frame_index, semantic_radius):
     num_frames = coeff_3dmm.shape[0]
     seq = list(range(frame_index- semantic_radius, frame_index + semantic_radius+1))
@@ -1,52 +1,62 @@
-import torch, uuid
+import uuid
 import os, sys, shutil
-from utils.preprocess import CropAndExtract
-from test_audio2coeff import Audio2Coeff  
-from facerender.animate import AnimateFromCoeff
-from generate_batch import get_data
-from generate_facerender_batch import get_facerender_data
-from SadTalker.src.utils.init_path import init_path
-from pydub import AudioSegment
 import logging, traceback
 
+# torch, pydub and the model stack are imported where they are first needed, so importing
+# this module (e.g. to hand the class to a worker process) stays cheap
+
 # === Setup logging for SadTalker ===
 logging.basicConfig(level=logging.DEBUG, format='[SADTALKER-LOG] %(message)s')
 
 def mp3_to_wav(mp3_filename, wav_filename, frame_rate):
+    from pydub import AudioSegment
     mp3_file = AudioSegment.from_file(file=mp3_filename)
     mp3_file.set_frame_rate(frame_rate).export(wav_filename, format="wav")
 
 
 class SadTalker():
-    def __init__(self, checkpoint_path='checkpoints', config_path='src/config', lazy_load=False):
+    def __init__(self, checkpoint_path='checkpoints', config_path='src/config', lazy_load=False, max_pool_bytes=None, preprocess_cache_dir=None):
+        import torch
+        from utils.model_pool import ModelPool
+
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         os.environ['TORCH_HOME'] = checkpoint_path
         self.checkpoint_path = checkpoint_path
         self.config_path = config_path
+        self.model_pool = ModelPool(checkpoint_path, config_path, max_bytes=max_pool_bytes,
+                                    preprocess_cache_dir=preprocess_cache_dir)
+
+    def warmup(self, variants=((256, 'crop'),), dummy_inference=True, enhancer=False):
+        """
+        Load the models for the given (size, preprocess) variants before the first request and,
+        with dummy_inference, run a tiny input through each. Returns a per-variant report.
+        """
+        report = {}
+        for (size, preprocess), models in zip(variants, self.model_pool.warmup(variants, device=self.device)):
+            key = self.model_pool.key(size, preprocess, self.device)
+            report[f"{size}/{key[1]}"] = {
+                "load_seconds": round(self.model_pool.load_times.get(key, 0.0), 3),
+                "models": models.warmup(size, enhancer) if dummy_inference else {},
+            }
+        return report
 
     def test(self, source_image, driven_audio, preprocess='crop', 
              still_mode=False, use_enhancer=False, batch_size=1, size=256, 
              pose_style=0, exp_scale=1.0, 
              use_ref_video=False, ref_video=None, ref_info=None,
              use_idle_mode=False, length_of_audio=0, use_blink=True,
-             result_dir='./results/'):
-
-        try:
-            logging.debug("Initializing SadTalker paths...")
-            self.sadtalker_paths = init_path(self.checkpoint_path, self.config_path, size, False, preprocess)
-            logging.debug(f"Paths: {self.sadtalker_paths}")
+             result_dir='./results/', render_chunk_size='auto', debug_artifacts=False, scene=None):
 
-            logging.debug("Loading Audio2Coeff model...")
-            self.audio_to_coeff = Audio2Coeff(self.sadtalker_paths, self.device)
-            logging.debug("Audio2Coeff loaded successfully ✅")
+        from generate_batch import get_data
+        from generate_facerender_batch import get_facerender_data
 
-            logging.debug("Loading CropAndExtract model...")
-            self.preprocess_model = CropAndExtract(self.sadtalker_paths, self.device)
-            logging.debug("CropAndExtract loaded successfully ✅")
-
-            logging.debug("Loading AnimateFromCoeff model...")
-            self.animate_from_coeff = AnimateFromCoeff(self.sadtalker_paths, self.device)
-            logging.debug("AnimateFromCoeff loaded successfully ✅")
+        try:
+            # --- Fetch warm models (loaded once per process and variant) ---
+            models = self.model_pool.get(size, preprocess, self.device)
+            preprocess_model = models.preprocess_model
+            audio_to_coeff = models.audio_to_coeff
+            animate_from_coeff = models.animate_from_coeff
+            logging.debug(f"Using pooled models for {self.model_pool.key(size, preprocess, self.device)}")
 
             # --- Setup directories ---
             time_tag = str(uuid.uuid4())
@@ -56,12 +66,12 @@ class SadTalker():
             os.makedirs(input_dir, exist_ok=True)
             logging.debug(f"Created save_dir: {save_dir} and input_dir: {input_dir}")
 
-            # --- Move source image ---
+            # --- Copy source image (callers may share it across concurrent requests) ---
             pic_path = os.path.join(input_dir, os.path.basename(source_image)) 
-            shutil.move(source_image, pic_path)
-            logging.debug(f"Moved source_image to {pic_path}")
+            shutil.copy(source_image, pic_path)
+            logging.debug(f"Copied source_image to {pic_path}")
 
-            # --- Move or convert driven audio ---
+            # --- Copy or convert driven audio ---
             if driven_audio and os.path.isfile(driven_audio):
                 audio_path = os.path.join(input_dir, os.path.basename(driven_audio))
                 if '.mp3' in audio_path:
@@ -69,10 +79,11 @@ class SadTalker():
                     mp3_to_wav(driven_audio, audio_path.replace('.mp3', '.wav'), 16000)
                     audio_path = audio_path.replace('.mp3', '.wav')
                 else:
-                    shutil.move(driven_audio, input_dir)
+                    shutil.copy(driven_audio, audio_path)
                 logging.debug(f"Audio prepared at {audio_path}")
             elif use_idle_mode:
                 audio_path = os.path.join(input_dir, f'idlemode_{length_of_audio}.wav')
+                from pydub import AudioSegment
                 AudioSegment.silent(duration=1000*length_of_audio).export(audio_path, format="wav")
                 logging.debug(f"Generated silent audio at {audio_path}")
             else:
@@ -81,7 +92,7 @@ class SadTalker():
             # --- Preprocess first frame ---
             first_frame_dir = os.path.join(save_dir, 'first_frame_dir')
             os.makedirs(first_frame_dir, exist_ok=True)
-            first_coeff_path, crop_pic_path, crop_info = self.preprocess_model.generate(pic_path, first_frame_dir, preprocess, True, size)
+            first_coeff_path, crop_pic_path, crop_info = preprocess_model.generate(pic_path, first_frame_dir, preprocess, True, size)
             if first_coeff_path is None:
                 raise AttributeError("No face detected in source image")
             logging.debug(f"First frame processed: coeff_path={first_coeff_path}")
@@ -92,7 +103,7 @@ class SadTalker():
                 ref_video_frame_dir = os.path.join(save_dir, ref_video_videoname)
                 os.makedirs(ref_video_frame_dir, exist_ok=True)
                 logging.debug("Extracting 3DMM from reference video...")
-                ref_video_coeff_path, _, _ = self.preprocess_model.generate(ref_video, ref_video_frame_dir, preprocess, source_image_flag=False)
+                ref_video_coeff_path, _, _ = preprocess_model.generate(ref_video, ref_video_frame_dir, preprocess, source_image_flag=False)
             else:
                 ref_video_coeff_path = None
 
@@ -104,29 +115,20 @@ class SadTalker():
                                  ref_eyeblink_coeff_path=None, still=still_mode,
                                  idlemode=use_idle_mode, length_of_audio=length_of_audio,
                                  use_blink=use_blink)
-                coeff_path = self.audio_to_coeff.generate(batch, save_dir, pose_style)
+                coeff_path = audio_to_coeff.generate(batch, save_dir, pose_style)
             logging.debug(f"Coefficient generation completed: {coeff_path}")
 
             # --- Generate video ---
             data = get_facerender_data(coeff_path, crop_pic_path, first_coeff_path, audio_path,
                                        batch_size, still_mode=still_mode, preprocess=preprocess,
-                                       size=size, expression_scale=exp_scale)
-            video_path = self.animate_from_coeff.generate(data, save_dir, pic_path, crop_info,
+                                       size=size, expression_scale=exp_scale, lazy_semantics=True,
+                                       debug_artifacts=debug_artifacts)
+            video_path = animate_from_coeff.generate(data, save_dir, pic_path, crop_info,
                                                           enhancer='gfpgan' if use_enhancer else None,
-                                                          preprocess=preprocess, img_size=size)
+                                                          preprocess=preprocess, img_size=size,
+                                                          render_chunk_size=render_chunk_size, scene=scene)
             logging.debug(f"Video generated at: {video_path}")
 
-            # --- Cleanup ---
-            del self.preprocess_model
-            del self.audio_to_coeff
-            del self.animate_from_coeff
-            import gc
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-            gc.collect()
-            logging.debug("Memory cleaned up successfully ✅")
-
             return video_path
 
         except Exception as e:
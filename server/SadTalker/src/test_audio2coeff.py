@@ -12,9 +12,10 @@ from audio2pose_models.audio2pose import Audio2Pose
 from audio2exp_models.networks import SimpleWrapperV2 
 from audio2exp_models.audio2exp import Audio2Exp
 from utils.safetensor_helper import load_x_from_safetensor  
+from utils.weights import load_torch
 
 def load_cpk(checkpoint_path, model=None, optimizer=None, device="cpu"):
-    checkpoint = torch.load(checkpoint_path, map_location=torch.device(device))
+    checkpoint = load_torch(checkpoint_path, map_location=torch.device(device))
     if model is not None:
         model.load_state_dict(checkpoint['model'])
     if optimizer is not None:
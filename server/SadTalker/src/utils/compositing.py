@@ -0,0 +1,258 @@
+import os
+import hashlib
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+import cv2
+import imageio_ffmpeg
+import numpy as np
+
+from utils.videoio import FFmpegWriter
+
+
+def read_rgb(path):
+    """ First frame of an image or video file as an RGB uint8 array. """
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        video_stream = cv2.VideoCapture(path)
+        still_reading, img = video_stream.read()
+        video_stream.release()
+        if not still_reading:
+            raise ValueError('can not decode %s' % path)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def read_alpha(path):
+    """ Alpha channel of a PNG as float32 in [0, 1]; fully opaque if it has none. """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError('can not decode %s' % path)
+    if img.ndim == 3 and img.shape[2] == 4:
+        return img[:, :, 3].astype(np.float32) / 255.
+    return np.ones(img.shape[:2], np.float32)
+
+
+def crop_region(crop_info, image_shape):
+    """ (x1, y1, x2, y2) of the source image that the rendered frames show, as paste_pic computes it. """
+    if crop_info is None or len(crop_info) != 3 or crop_info[1] is None or crop_info[2] is None:
+        return None
+    clx, cly, crx, cry = crop_info[1]
+    lx, ly, rx, ry = [int(v) for v in crop_info[2]]
+    x1, y1, x2, y2 = clx + lx, cly + ly, clx + rx, cly + ry
+    h, w = image_shape[:2]
+    if x1 < 0 or y1 < 0 or x2 > w or y2 > h or x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def feather_mask(alpha, size, radius=12, passes=12):
+    """
+    Resize alpha to size (w, h) and soften its edges with repeated box blurs,
+    the same as ffmpeg's boxblur=radius:passes. Returns (h, w, 1) float32.
+    """
+    mask = cv2.resize(alpha, size, interpolation=cv2.INTER_AREA)
+    k = 2 * radius + 1
+    for _ in range(passes):
+        mask = cv2.blur(mask, (k, k))
+    return np.clip(mask, 0., 1.)[:, :, None]
+
+
+def _file_key(path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _frozen(array):
+    # shared between compositors; a stray in-place write would corrupt every later scene
+    array.flags.writeable = False
+    return array
+
+
+class SceneAssetCache():
+    """
+    Process-wide cache of decoded scene assets, bounded at max_bytes (LRU).
+
+    Backgrounds are kept as RGB frames at the requested resolution, avatar alphas
+    and feathered masks per (avatar, crop, size, feather). Music is decoded once to
+    raw s16le PCM at the mix sample rate and kept on disk under pcm_dir, where
+    ffmpeg reads it without decoding; every process can share that directory.
+    Cached arrays are read-only and handed out without copies.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, pcm_dir=None, pcm_max_bytes=1024 ** 3, sample_rate=44100, channels=2):
+        self.max_bytes = max_bytes
+        self.pcm_dir = os.path.abspath(pcm_dir or os.path.join(tempfile.gettempdir(), 'scene_pcm'))
+        self.pcm_max_bytes = pcm_max_bytes
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = _frozen(build())
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = value
+                self._nbytes += value.nbytes
+                while len(self._entries) > 1 and self._nbytes > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self._nbytes -= old.nbytes
+            return self._entries[key]
+
+    def nbytes(self):
+        return self._nbytes
+
+    def background(self, path, size=None):
+        """ RGB uint8 frame of path, resized to size (w, h) if given. """
+        def build():
+            img = read_rgb(path)
+            if size is not None and (img.shape[1], img.shape[0]) != tuple(size):
+                img = cv2.resize(img, tuple(size), interpolation=cv2.INTER_AREA)
+            return img
+        return self._get(('background', _file_key(path), size and tuple(size)), build)
+
+    def alpha(self, path):
+        return self._get(('alpha', _file_key(path)), lambda: read_alpha(path))
+
+    def mask(self, avatar_png, region, size, feather=12):
+        """ Feathered (h, w, 1) mask of the avatar alpha cut to region and scaled to size (w, h). """
+        def build():
+            alpha = self.alpha(avatar_png)
+            if region is not None:
+                x1, y1, x2, y2 = region
+                alpha = alpha[y1:y2, x1:x2]
+            return feather_mask(alpha, tuple(size), feather, feather)
+        return self._get(('mask', _file_key(avatar_png), region, tuple(size), feather), build)
+
+    def music(self, path):
+        """ Path of path decoded to s16le PCM at (sample_rate, channels), decoding it on first use. """
+        name = hashlib.sha1(repr((_file_key(path), self.sample_rate, self.channels)).encode()).hexdigest() + '.pcm'
+        pcm_path = os.path.join(self.pcm_dir, name)
+        if os.path.exists(pcm_path):
+            os.utime(pcm_path)
+            self.hits += 1
+            return pcm_path
+
+        self.misses += 1
+        os.makedirs(self.pcm_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.pcm_dir, suffix='.part')
+        os.close(fd)
+        cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error', '-i', path,
+               '-vn', '-f', 's16le', '-ar', str(self.sample_rate), '-ac', str(self.channels), tmp_path]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            os.remove(tmp_path)
+            raise RuntimeError('ffmpeg failed decoding %s (exit %d): %s' % (path, proc.returncode, proc.stderr.decode(errors='replace').strip()))
+        # atomic publish: concurrent workers decoding the same track both end up with a complete file
+        os.replace(tmp_path, pcm_path)
+        self._evict_pcm(keep=pcm_path)
+        return pcm_path
+
+    def _evict_pcm(self, keep):
+        entries = []
+        for e in os.scandir(self.pcm_dir):
+            if e.name.endswith('.pcm') and e.path != keep:
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.pcm_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+_default_assets = None
+
+
+def get_scene_assets():
+    """ The shared SceneAssetCache of this process. """
+    global _default_assets
+    if _default_assets is None:
+        _default_assets = SceneAssetCache()
+    return _default_assets
+
+
+class SceneCompositor():
+    """
+    Places rendered avatar frames onto a still background in memory, so the final
+    scene is encoded once together with the speech and the music.
+
+    Background, avatar mask and music PCM come from a SceneAssetCache, so they are
+    decoded once per scene rather than once per render. composite() only rewrites the
+    avatar's rectangle of a reused output frame.
+    """
+
+    def __init__(self, background_path, avatar_png, music_path=None, avatar_width=550, bottom_margin=150,
+                 feather=12, music_volume=0.28, output_size=None, assets=None):
+        self.assets = assets or get_scene_assets()
+        self.background = self.assets.background(background_path, output_size)
+        self.avatar_png = avatar_png
+        self.alpha_shape = self.assets.alpha(avatar_png).shape
+        self.music_path = self.assets.music(music_path) if music_path else None
+        self.avatar_width = avatar_width
+        self.bottom_margin = bottom_margin
+        self.feather = feather
+        self.music_volume = music_volume
+        self._layout = None
+        self._frame = None
+
+    def prepare(self, crop_info, frame_size):
+        """ Fetch the mask and placement for frames of frame_size (w, h) rendered from crop_info. """
+        region = crop_region(crop_info, self.alpha_shape)
+
+        w = self.avatar_width
+        h = max(1, int(round(w * frame_size[1] / frame_size[0])))
+        mask = self.assets.mask(self.avatar_png, region, (w, h), self.feather)
+
+        # centred horizontally, bottom_margin above the bottom edge; clipped like ffmpeg's overlay
+        H, W = self.background.shape[:2]
+        x, y = (W - w) // 2, H - h - self.bottom_margin
+        bx1, by1, bx2, by2 = max(x, 0), max(y, 0), min(x + w, W), min(y + h, H)
+        if bx2 <= bx1 or by2 <= by1:
+            raise ValueError('avatar of %dx%d does not fit on a %dx%d background' % (w, h, W, H))
+        src = (slice(by1 - y, by2 - y), slice(bx1 - x, bx2 - x))
+        dst = (slice(by1, by2), slice(bx1, bx2))
+        self._layout = {'size': (w, h), 'dst': dst, 'src': src, 'mask': mask[src],
+                        'background': self.background[dst].astype(np.float32)}
+        self._frame = self.background.copy()
+        return self._layout
+
+    def composite(self, frame):
+        """
+        RGB uint8 avatar frame -> RGB uint8 scene frame. prepare() must have been called.
+        The returned array is reused by the next call.
+        """
+        layout = self._layout
+        avatar = cv2.resize(frame, layout['size'])[layout['src']].astype(np.float32)
+        roi = layout['background'] + (avatar - layout['background']) * layout['mask']
+        self._frame[layout['dst']] = np.clip(roi + 0.5, 0, 255).astype(np.uint8)
+        return self._frame
+
+    def writer(self, save_path, audio_path, duration=None, fps=25):
+        return FFmpegWriter(save_path, fps=fps, audio_path=audio_path, duration=duration,
+                            music_path=self.music_path, music_volume=self.music_volume,
+                            music_pcm=(self.assets.sample_rate, self.assets.channels) if self.music_path else None)
@@ -1,11 +1,16 @@
 import os
+import copy
+import threading
+import numpy as np
 import torch 
 
 from gfpgan import GFPGANer
 
 from tqdm import tqdm
 
-from utils.videoio import load_video_to_cv2
+from utils.videoio import VideoFrames
+from utils.parallel import ordered_map
+from utils.weights import get_weight_registry, load_torch, ENHANCER_MODELS
 
 import cv2
 
@@ -23,50 +28,221 @@ class GeneratorWithLen(object):
     def __iter__(self):
         return self.gen
 
-def enhancer_list(images, method='gfpgan', bg_upsampler='realesrgan'):
-    gen = enhancer_generator_no_len(images, method=method, bg_upsampler=bg_upsampler)
+def enhancer_list(images, method='gfpgan', bg_upsampler='realesrgan', workers=None):
+    gen = enhancer_generator_no_len(images, method=method, bg_upsampler=bg_upsampler, workers=workers)
     return list(gen)
 
-def enhancer_generator_with_len(images, method='gfpgan', bg_upsampler='realesrgan'):
+def enhancer_generator_with_len(images, method='gfpgan', bg_upsampler='realesrgan', workers=None):
     """ Provide a generator with a __len__ method so that it can passed to functions that
     call len()"""
 
-    if os.path.isfile(images): # handle video to images
-        # TODO: Create a generator version of load_video_to_cv2
-        images = load_video_to_cv2(images)
+    if isinstance(images, str) and os.path.isfile(images): # handle video to images
+        images = VideoFrames(images, rgb=True)
 
-    gen = enhancer_generator_no_len(images, method=method, bg_upsampler=bg_upsampler)
+    gen = enhancer_generator_no_len(images, method=method, bg_upsampler=bg_upsampler, workers=workers)
     gen_with_len = GeneratorWithLen(gen, len(images))
     return gen_with_len
 
-def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan'):
+def enhancer_workers():
+    # paste-back threads; the restoration itself runs batched in the calling thread
+    return max(1, min(4, (os.cpu_count() or 1) // 2))
+
+def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan', workers=None):
     """ Provide a generator function so that all of the enhanced images don't need
     to be stored in memory at the same time. This can save tons of RAM compared to
-    the enhancer function. """
+    the enhancer function. The restorer is kept warm across calls, see FaceEnhancer. """
 
     print('face enhancer....')
-    if not isinstance(images, list) and os.path.isfile(images): # handle video to images
-        images = load_video_to_cv2(images)
+    if isinstance(images, str) and os.path.isfile(images): # handle video to images
+        images = VideoFrames(images, rgb=True)
+
+    enhancer = get_face_enhancer(method, bg_upsampler)
+    for r_img in tqdm(enhancer.enhance_frames(images, workers=workers), 'Face Enhancer:', total=len(images)):
+        yield r_img
+
+_face_enhancers = {}
+_face_enhancers_lock = threading.Lock()
+
+def get_face_enhancer(method='gfpgan', bg_upsampler='realesrgan'):
+    """ The warm FaceEnhancer of this process for (method, bg_upsampler), built on first use. """
+    with _face_enhancers_lock:
+        key = (method, bg_upsampler)
+        if key not in _face_enhancers:
+            _face_enhancers[key] = FaceEnhancer(method, bg_upsampler)
+        return _face_enhancers[key]
+
+class FaceEnhancer():
+    """
+    GFPGAN restoration of talking-head frames with one warm restorer.
+
+    The face in a talking-head clip does not move, so faces are detected and aligned
+    once, on the first frame (or on the first frame where one is found), and the same
+    affine warp is reused for every later frame. The aligned faces of batch_size frames
+    are restored in one forward pass. Frames are pasted back in order on an ordered_map
+    thread pool; the face helper is shallow-copied for each frame, so the shared detection
+    and parsing networks are reused but its per-image state is not.
+    """
+
+    def __init__(self, method='gfpgan', bg_upsampler='realesrgan', batch_size=None):
+        self.restorer = build_restorer(method, bg_upsampler)
+        self.helper = self.restorer.face_helper
+        self.device = self.restorer.device
+        self.batch_size = batch_size or (8 if self.device.type == 'cuda' else 2)
+        self._lock = threading.Lock()
+        # RealESRGANer keeps per-image state as well
+        self._bg_lock = threading.Lock()
+
+    def align(self, img):
+        """ Detect the faces in a BGR image; returns their (affine, inverse affine) matrices. """
+        with self._lock:
+            helper = self.helper
+            helper.clean_all()
+            helper.read_image(img)
+            helper.get_face_landmarks_5(only_center_face=False, eye_dist_threshold=5)
+            helper.align_warp_face()
+            helper.get_inverse_affine(None)
+            alignment = (list(helper.affine_matrices), list(helper.inverse_affine_matrices))
+            helper.clean_all()
+        return alignment
+
+    def _restore(self, crops):
+        # (n, 512, 512, 3) uint8 BGR -> restored faces, normalized as img2tensor + normalize do it
+        batch = torch.from_numpy(np.ascontiguousarray(np.stack(crops)[..., ::-1])).to(self.device)
+        batch = batch.permute(0, 3, 1, 2).float().div_(127.5).sub_(1)
+        try:
+            with torch.no_grad():
+                output = self.restorer.gfpgan(batch, return_rgb=False, weight=0.5)[0]
+            # same as tensor2img(min_max=(-1, 1)), for the whole batch at once
+            output = output.clamp_(-1, 1).add_(1).mul_(127.5).round_().to(torch.uint8)
+            output = output.permute(0, 2, 3, 1).flip(-1).cpu().numpy()
+            return list(output)
+        except RuntimeError as error:
+            print(f'\tFailed inference for GFPGAN: {error}.')
+            return list(crops)
+
+    def _paste(self, item):
+        img, inverse, restored = item
+        helper = copy.copy(self.helper)
+        helper.read_image(img)
+        # paste_faces_to_input_image shifts the matrices in place
+        helper.inverse_affine_matrices = [m.copy() for m in inverse]
+        helper.restored_faces = restored
+        bg_img = None
+        if self.restorer.bg_upsampler is not None:
+            with self._bg_lock:
+                bg_img = self.restorer.bg_upsampler.enhance(img, outscale=self.restorer.upscale)[0]
+        r_img = helper.paste_faces_to_input_image(upsample_img=bg_img)
+        return cv2.cvtColor(r_img, cv2.COLOR_BGR2RGB)
+
+    def _restored_batches(self, images):
+        alignment = None
+        batch = []
 
+        def flush(batch, alignment):
+            affine, inverse = alignment
+            crops = [cv2.warpAffine(img, m, self.helper.face_size, borderMode=cv2.BORDER_CONSTANT, borderValue=(135, 133, 132))
+                     for img in batch for m in affine]
+            restored = self._restore(crops) if crops else []
+            k = len(affine)
+            return [(img, inverse, restored[i * k:(i + 1) * k]) for i, img in enumerate(batch)]
+
+        for image in images:
+            img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            if alignment is None or not alignment[0]:
+                # no face yet: keep looking, frame by frame
+                found = self.align(img)
+                if batch and found[0]:
+                    # frames buffered without a face are restored with their own (empty) alignment
+                    for item in flush(batch, alignment):
+                        yield item
+                    batch = []
+                alignment = found
+            batch.append(img)
+            if len(batch) >= self.batch_size:
+                for item in flush(batch, alignment):
+                    yield item
+                batch = []
+        if batch:
+            for item in flush(batch, alignment):
+                yield item
+
+    def warmup(self):
+        """ Run one blank face through the restorer (detection finds nothing on a blank frame). """
+        self._restore([np.full(self.helper.face_size[::-1] + (3,), 128, dtype=np.uint8)])
+
+    def enhance_frames(self, images, workers=None):
+        """ Yield the restored RGB frames of an iterable of RGB frames, in order. """
+        return ordered_map(self._paste, self._restored_batches(images), workers or enhancer_workers())
+
+class LocalGFPGANer(GFPGANer):
+    """
+    GFPGANer that loads every weight from local files. GFPGANer itself looks for the face
+    helper weights under a cwd-relative gfpgan/weights and downloads whatever is missing.
+    """
+
+    def __init__(self, model_path, face_weights_dir, upscale=2, arch='clean', channel_multiplier=2, bg_upsampler=None, device=None):
+        from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+
+        self.upscale = upscale
+        self.bg_upsampler = bg_upsampler
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+        if arch == 'clean':
+            from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+            self.gfpgan = GFPGANv1Clean(
+                out_size=512,
+                num_style_feat=512,
+                channel_multiplier=channel_multiplier,
+                decoder_load_path=None,
+                fix_decoder=False,
+                num_mlp=8,
+                input_is_latent=True,
+                different_w=True,
+                narrow=1,
+                sft_half=True)
+        elif arch == 'RestoreFormer':
+            from gfpgan.archs.restoreformer_arch import RestoreFormer
+            self.gfpgan = RestoreFormer()
+        else:
+            raise ValueError(f'Unsupported restorer architecture {arch}.')
+        self.face_helper = FaceRestoreHelper(
+            upscale,
+            face_size=512,
+            crop_ratio=(1, 1),
+            det_model='retinaface_resnet50',
+            save_ext='png',
+            use_parse=True,
+            device=self.device,
+            model_rootpath=face_weights_dir)
+
+        loadnet = load_torch(model_path, map_location='cpu')
+        keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+        self.gfpgan.load_state_dict(loadnet[keyname], strict=True)
+        self.gfpgan.eval()
+        self.gfpgan = self.gfpgan.to(self.device)
+
+def build_restorer(method='gfpgan', bg_upsampler='realesrgan'):
     # ------------------------ set up GFPGAN restorer ------------------------
     if  method == 'gfpgan':
         arch = 'clean'
         channel_multiplier = 2
         model_name = 'GFPGANv1.4'
-        url = 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth'
     elif method == 'RestoreFormer':
         arch = 'RestoreFormer'
         channel_multiplier = 2
         model_name = 'RestoreFormer'
-        url = 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/RestoreFormer.pth'
-    elif method == 'codeformer': # TODO:
-        arch = 'CodeFormer'
-        channel_multiplier = 2
-        model_name = 'CodeFormer'
-        url = 'https://github.com/sczhou/CodeFormer/releases/download/v0.1.0/codeformer.pth'
     else:
         raise ValueError(f'Wrong model version {method}.')
 
+    # every weight comes from the local registry, checked before anything is built
+    registry = get_weight_registry()
+    names = list(ENHANCER_MODELS[method])
+    if bg_upsampler == 'realesrgan' and torch.cuda.is_available():
+        names.append('RealESRGAN_x2plus')
+    weights = registry.require(names)
+    face_weights_dir = os.path.dirname(weights['detection_Resnet50_Final'])
+    if os.path.dirname(weights['parsing_parsenet']) != face_weights_dir:
+        raise FileNotFoundError(f'detection_Resnet50_Final.pth and parsing_parsenet.pth must be in the same directory '
+                                f'({face_weights_dir} vs {os.path.dirname(weights["parsing_parsenet"])})')
 
     # ------------------------ set up background upsampler ------------------------
     if bg_upsampler == 'realesrgan':
@@ -81,7 +257,7 @@ def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan'
             model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
             bg_upsampler = RealESRGANer(
                 scale=2,
-                model_path='https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth',
+                model_path=weights['RealESRGAN_x2plus'],
                 model=model,
                 tile=400,
                 tile_pad=10,
@@ -90,34 +266,12 @@ def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan'
     else:
         bg_upsampler = None
 
-    # determine model paths
-    model_path = os.path.join('gfpgan/weights', model_name + '.pth')
-    
-    if not os.path.isfile(model_path):
-        model_path = os.path.join('checkpoints', model_name + '.pth')
-    
-    if not os.path.isfile(model_path):
-        # download pre-trained models from url
-        model_path = url
-
-    restorer = GFPGANer(
-        model_path=model_path,
+    restorer = LocalGFPGANer(
+        model_path=weights[model_name],
+        face_weights_dir=face_weights_dir,
         upscale=2,
         arch=arch,
         channel_multiplier=channel_multiplier,
         bg_upsampler=bg_upsampler)
 
-    # ------------------------ restore ------------------------
-    for idx in tqdm(range(len(images)), 'Face Enhancer:'):
-        
-        img = cv2.cvtColor(images[idx], cv2.COLOR_RGB2BGR)
-        
-        # restore faces and background if necessary
-        cropped_faces, restored_faces, r_img = restorer.enhance(
-            img,
-            has_aligned=False,
-            only_center_face=False,
-            paste_back=True)
-        
-        r_img = cv2.cvtColor(r_img, cv2.COLOR_BGR2RGB)
-        yield r_img
+    return restorer
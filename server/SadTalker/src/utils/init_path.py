@@ -1,6 +1,11 @@
 import os
 import glob
 
+from utils.weights import WEIGHTS_DIR
+
+# the per-size checkpoint preferred over the legacy PTH files whenever it is installed
+SAFETENSOR_NAME = 'SadTalker_V0.0.2_%d.safetensors'
+
 def init_path(checkpoint_dir=None, config_dir=None, size=512, old_version=False, preprocess='crop'):
     """
     Initialize and return SadTalker paths for checkpoints, YAML configs, and options.
@@ -22,7 +27,7 @@ def init_path(checkpoint_dir=None, config_dir=None, size=512, old_version=False,
 
     # Defaults
     if checkpoint_dir is None:
-        checkpoint_dir = os.path.join(sad_root, "checkpoints")
+        checkpoint_dir = WEIGHTS_DIR
     if config_dir is None:
         config_dir = os.path.join(sad_root, "config")
 
@@ -46,7 +51,10 @@ def init_path(checkpoint_dir=None, config_dir=None, size=512, old_version=False,
     # Option 2: Safetensor detected
     elif len(glob.glob(os.path.join(checkpoint_dir, '*.safetensors'))):
         print('Using safetensor as default')
-        safetensor_file = glob.glob(os.path.join(checkpoint_dir, '*.safetensors'))[0]
+        # prefer the checkpoint trained for this size when both are installed
+        safetensor_file = os.path.join(checkpoint_dir, SAFETENSOR_NAME % size)
+        if not os.path.isfile(safetensor_file):
+            safetensor_file = sorted(glob.glob(os.path.join(checkpoint_dir, '*.safetensors')))[0]
         sadtalker_paths['checkpoint'] = safetensor_file
         use_safetensor = True
 
@@ -0,0 +1,190 @@
+import gc
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import torch
+
+from utils.init_path import init_path
+from utils.weights import get_weight_registry, sadtalker_weights, FACE_MODELS
+
+
+def _module_bytes(obj, seen=None):
+    """ Rough resident size of every torch module reachable from the attributes of obj. """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        total = 0
+        for t in list(obj.parameters()) + list(obj.buffers()):
+            total += t.numel() * t.element_size()
+        return total
+
+    total = 0
+    for value in getattr(obj, '__dict__', {}).values():
+        if isinstance(value, torch.nn.Module) or hasattr(value, '__dict__'):
+            total += _module_bytes(value, seen)
+    return total
+
+
+class SadTalkerModels():
+    """ The three sub-models needed by one (size, preprocess, device) variant. """
+
+    def __init__(self, sadtalker_paths, device, preprocess_cache_dir=None):
+        from utils.preprocess import CropAndExtract
+        from test_audio2coeff import Audio2Coeff
+        from facerender.animate import AnimateFromCoeff
+
+        self.sadtalker_paths = sadtalker_paths
+        self.device = device
+
+        logging.debug("Loading Audio2Coeff model...")
+        self.audio_to_coeff = Audio2Coeff(sadtalker_paths, device)
+        logging.debug("Loading CropAndExtract model...")
+        self.preprocess_model = CropAndExtract(sadtalker_paths, device, cache_dir=preprocess_cache_dir)
+        logging.debug("Loading AnimateFromCoeff model...")
+        self.animate_from_coeff = AnimateFromCoeff(sadtalker_paths, device)
+
+        self.nbytes = _module_bytes(self)
+
+    def warmup(self, size=256, enhancer=False):
+        """
+        Push a tiny dummy input through every network so lazy CUDA/cuDNN init, kernel
+        selection and first-touch allocations happen now rather than in the first request.
+        Returns {model: {"status": "ok"|"error", "seconds": float[, "error": str]}}.
+        """
+        import numpy as np
+
+        device = self.device
+        report = OrderedDict()
+
+        def run(name, fn):
+            start = time.time()
+            try:
+                with torch.no_grad():
+                    fn()
+                report[name] = {"status": "ok", "seconds": round(time.time() - start, 3)}
+            except Exception as e:
+                logging.exception(f"Warmup of {name} failed")
+                report[name] = {"status": "error", "seconds": round(time.time() - start, 3), "error": str(e)}
+
+        predictor = self.preprocess_model.propress.predictor
+        blank = np.zeros((size, size, 3), np.uint8)
+        run("face_detector", lambda: predictor.det_net.detect_faces(blank, 0.97))
+        run("landmarks", lambda: predictor.detector.get_landmarks(blank))
+        run("net_recon", lambda: self.preprocess_model.net_recon(torch.zeros(1, 3, 224, 224, device=device)))
+
+        # the shapes get_data produces for a one second clip
+        frames = 25
+        batch = {'indiv_mels': torch.zeros(1, frames, 1, 80, 16, device=device),
+                 'ref': torch.zeros(1, frames, 70, device=device),
+                 'num_frames': frames,
+                 'ratio_gt': torch.zeros(1, frames, 1, device=device),
+                 'class': torch.LongTensor([0]).to(device)}
+        run("audio2exp", lambda: self.audio_to_coeff.audio2exp_model.test(batch))
+        run("audio2pose", lambda: self.audio_to_coeff.audio2pose_model.test(batch))
+
+        from facerender.modules.make_animation import make_animation
+        animate = self.animate_from_coeff
+        # 70 coefficients for crop variants, 73 for the 'full' (facerender_still) mapping network
+        coeff_nc = animate.mapping.first[0].in_channels
+        run("facerender", lambda: make_animation(torch.zeros(1, 3, size, size, device=device),
+                                                 torch.zeros(1, coeff_nc, 27, device=device),
+                                                 torch.zeros(1, 2, coeff_nc, 27, device=device),
+                                                 animate.generator, animate.kp_extractor, animate.he_estimator,
+                                                 animate.mapping, chunk_size=2))
+
+        if enhancer:
+            from utils.face_enhancer import get_face_enhancer
+            run("enhancer", lambda: get_face_enhancer(enhancer if isinstance(enhancer, str) else 'gfpgan', None).warmup())
+        return report
+
+
+class ModelPool():
+    """
+    Process-wide registry of warm SadTalker models keyed by (size, preprocess, device).
+
+    Variants are loaded on first use and kept until the estimated resident size of
+    the pool exceeds max_bytes, at which point the least recently used variants are
+    dropped. The most recently requested variant is never evicted.
+    """
+
+    def __init__(self, checkpoint_path, config_path, max_bytes=None, preprocess_cache_dir=None):
+        self.checkpoint_path = checkpoint_path
+        self.config_path = config_path
+        self.max_bytes = max_bytes
+        self.preprocess_cache_dir = preprocess_cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.load_times = {}
+
+    @staticmethod
+    def key(size, preprocess, device):
+        # only the 'full' family switches mappingnet / facerender config in init_path
+        return (int(size), 'full' if 'full' in preprocess.lower() else 'crop', device)
+
+    def get(self, size=256, preprocess='crop', device='cpu'):
+        key = self.key(size, preprocess, device)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            start = time.time()
+            sadtalker_paths = init_path(self.checkpoint_path, self.config_path, size, False, preprocess)
+            # fail fast, with one report of everything missing, before any model is built
+            weights = sadtalker_weights(sadtalker_paths)
+            weights.update({name: get_weight_registry().path(name) for name in FACE_MODELS})
+            get_weight_registry().require(weights)
+            models = SadTalkerModels(sadtalker_paths, device, self.preprocess_cache_dir)
+            self.load_times[key] = time.time() - start
+            logging.debug(f"Loaded SadTalker models for {key} in {self.load_times[key]:.2f}s ({models.nbytes / 2**20:.0f} MiB)")
+
+            self._entries[key] = models
+            self._evict()
+            return models
+
+    def warmup(self, variants=((256, 'crop'),), device='cpu'):
+        """ Load every (size, preprocess) variant ahead of the first request. """
+        return [self.get(size, preprocess, device) for size, preprocess in variants]
+
+    def loaded(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def nbytes(self):
+        with self._lock:
+            return sum(models.nbytes for models in self._entries.values())
+
+    def evict(self, size, preprocess, device):
+        with self._lock:
+            models = self._entries.pop(self.key(size, preprocess, device), None)
+        if models is not None:
+            self._release()
+        return models is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._release()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        evicted = False
+        while len(self._entries) > 1 and self.nbytes() > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            logging.debug(f"Evicted SadTalker models for {key}")
+            evicted = True
+        if evicted:
+            self._release()
+
+    @staticmethod
+    def _release():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -0,0 +1,45 @@
+import os
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def default_workers(limit=8):
+    return max(1, min(limit, os.cpu_count() or 1))
+
+
+def ordered_map(fn, items, workers=None, max_in_flight=None, processes=False, initializer=None, initargs=()):
+    """
+    Apply fn to every item on a pool and yield the results in input order.
+
+    items is consumed lazily in the calling thread (e.g. while decoding a video), and at
+    most max_in_flight items (default 2 * workers) are submitted but not yet yielded, so
+    memory stays bounded however long the input is. Threads suit cv2 / numpy / torch work,
+    which releases the GIL; processes=True uses a spawn process pool instead, in which
+    case fn, items and results must pickle. workers=1 runs inline without a pool.
+    Closing the generator early cancels whatever has not started yet.
+    """
+    workers = workers or default_workers()
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    if workers == 1 and not processes:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield fn(item)
+        return
+
+    if processes:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                   initializer=initializer, initargs=initargs)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
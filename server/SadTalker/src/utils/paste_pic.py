@@ -1,11 +1,100 @@
 import cv2, os
 import numpy as np
 from tqdm import tqdm
-import uuid
 
-from utils.videoio import save_video_with_watermark 
+from utils.videoio import FFmpegWriter, VideoFrames
+from utils.parallel import ordered_map
 
-def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path, extended_crop=False):
+
+def feather_weights(size, feather=0.08):
+    """ (h, w) float32 blend weights: 1 inside, easing to 0 over the outer feather fraction of the box. """
+    w, h = size
+    ramp = max(1.0, feather * min(w, h))
+
+    def edge(n):
+        d = np.minimum(np.arange(n) + 0.5, n - np.arange(n) - 0.5) / ramp
+        d = np.clip(d, 0, 1)
+        return d * d * (3 - 2 * d)  # smoothstep
+
+    return np.minimum(edge(h)[:, None], edge(w)[None, :]).astype(np.float32)
+
+
+class PasteBack():
+    """
+    Paste rendered crops back into the full picture.
+
+    The destination region, the feathered blend mask and the weighted background are
+    computed once per video, so each frame is a resize and one vectorized alpha blend.
+    calibrate() runs seamlessClone once, on a downscaled first frame, and keeps the
+    smooth color offset it applies; that offset is added to every frame in place of a
+    full-resolution Poisson solve per frame. __call__ is thread-safe.
+    """
+
+    def __init__(self, full_img, box, feather=0.08, correct_size=96):
+        ox1, oy1, ox2, oy2 = box
+        frame_h, frame_w = full_img.shape[:2]
+        self.full_img = full_img
+        self.box = box
+        self.size = (ox2 - ox1, oy2 - oy1)
+        self.correct_size = correct_size
+        # only the part of the box inside the picture is pasted
+        x1, y1, x2, y2 = max(ox1, 0), max(oy1, 0), min(ox2, frame_w), min(oy2, frame_h)
+        self.dst = (slice(y1, y2), slice(x1, x2))
+        self.src = (slice(y1 - oy1, y2 - oy1), slice(x1 - ox1, x2 - ox1))
+        self.alpha = feather_weights(self.size, feather)[self.src][..., None]
+        # out = background * (1 - alpha) + (frame + offset) * alpha; everything but frame * alpha is fixed
+        self._keep = full_img[self.dst].astype(np.float32) * (1 - self.alpha) + 0.5
+        self.base = self._keep
+
+    def _crop(self, crop_frame):
+        return cv2.resize(crop_frame.astype(np.uint8, copy=False), self.size)[self.src]
+
+    def calibrate(self, crop_frame):
+        """ Derive the color offset field from a low-resolution Poisson clone of crop_frame. """
+        p = self._crop(crop_frame)
+        h, w = p.shape[:2]
+        scale = min(1.0, self.correct_size / max(h, w))
+        small = (max(4, int(round(w * scale))), max(4, int(round(h * scale))))
+        p_small = cv2.resize(p, small, interpolation=cv2.INTER_AREA)
+        # clone into the downscaled destination region with a small margin, as seamlessClone needs room
+        margin = 2
+        dst_small = cv2.resize(self.full_img[self.dst], small, interpolation=cv2.INTER_AREA)
+        dst_small = cv2.copyMakeBorder(dst_small, margin, margin, margin, margin, cv2.BORDER_REPLICATE)
+        center = (margin + small[0] // 2, margin + small[1] // 2)
+        cloned = cv2.seamlessClone(p_small, dst_small, 255 * np.ones(p_small.shape, p_small.dtype), center, cv2.NORMAL_CLONE)
+        offset = cloned[margin:margin + small[1], margin:margin + small[0]].astype(np.float32) - p_small.astype(np.float32)
+        offset = cv2.resize(offset, (w, h), interpolation=cv2.INTER_LINEAR)
+        self.base = self._keep + offset * self.alpha
+
+    def __call__(self, crop_frame):
+        blended = self._crop(crop_frame).astype(np.float32)
+        blended *= self.alpha
+        blended += self.base
+        out = self.full_img.copy()
+        out[self.dst] = np.clip(blended, 0, 255).astype(np.uint8)
+        return out
+
+
+def seamless_paste(full_img, box):
+    """ The original paste-back: a full-resolution seamlessClone of every frame. """
+    ox1, oy1, ox2, oy2 = box
+
+    def paste(crop_frame):
+        p = cv2.resize(crop_frame.astype(np.uint8), (ox2-ox1, oy2 - oy1)) 
+        mask = 255*np.ones(p.shape, p.dtype)
+        location = ((ox1+ox2) // 2, (oy1+oy2) // 2)
+        return cv2.seamlessClone(p, full_img, mask, location, cv2.NORMAL_CLONE)
+
+    return paste
+
+
+def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path, extended_crop=False, duration=None,
+              blend='feather', color_correct=True, workers=None):
+    """
+    blend='feather' pastes with PasteBack (color corrected once unless color_correct=False);
+    blend='seamless' keeps the per-frame seamlessClone. Frames are pasted in parallel on
+    workers threads (default: one per core, up to 8) and written in order.
+    """
 
     if not os.path.isfile(pic_path):
         raise ValueError('pic_path must be a valid path to video/image file')
@@ -27,15 +116,9 @@ def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path,
     frame_h = full_img.shape[0]
     frame_w = full_img.shape[1]
 
-    video_stream = cv2.VideoCapture(video_path)
-    fps = video_stream.get(cv2.CAP_PROP_FPS)
-    crop_frames = []
-    while 1:
-        still_reading, frame = video_stream.read()
-        if not still_reading:
-            video_stream.release()
-            break
-        crop_frames.append(frame)
+    # decoded one frame at a time while cloning, so memory does not grow with the clip length
+    crop_frames = VideoFrames(video_path)
+    fps = crop_frames.fps
     
     if len(crop_info) != 3:
         print("you didn't crop the image")
@@ -53,17 +136,14 @@ def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path,
         else:
             oy1, oy2, ox1, ox2 = cly+ly, cly+ry, clx+lx, clx+rx
 
-    tmp_path = str(uuid.uuid4())+'.mp4'
-    out_tmp = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, (frame_w, frame_h))
-    for crop_frame in tqdm(crop_frames, 'seamlessClone:'):
-        p = cv2.resize(crop_frame.astype(np.uint8), (ox2-ox1, oy2 - oy1)) 
-
-        mask = 255*np.ones(p.shape, p.dtype)
-        location = ((ox1+ox2) // 2, (oy1+oy2) // 2)
-        gen_img = cv2.seamlessClone(p, full_img, mask, location, cv2.NORMAL_CLONE)
-        out_tmp.write(gen_img)
-
-    out_tmp.release()
+    if blend == 'seamless':
+        paste = seamless_paste(full_img, (ox1, oy1, ox2, oy2))
+    else:
+        paste = PasteBack(full_img, (ox1, oy1, ox2, oy2))
+        if color_correct:
+            paste.calibrate(next(iter(crop_frames)))
 
-    save_video_with_watermark(tmp_path, new_audio_path, full_video_path, watermark=False)
-    os.remove(tmp_path)
+    # cv2 frames are BGR; encoded and muxed with the audio in one ffmpeg pass
+    with FFmpegWriter(full_video_path, fps=fps, audio_path=new_audio_path, duration=duration, pix_fmt='bgr24') as out:
+        for gen_img in tqdm(ordered_map(paste, crop_frames, workers), 'Paste back:', total=len(crop_frames)):
+            out.write(gen_img)
@@ -1,11 +1,10 @@
 import numpy as np
 import cv2, os, sys, torch
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image 
 
 # 3dmm extraction
-import safetensors
-import safetensors.torch 
 from face3d.util.preprocess import align_img
 from face3d.util.load_mats import load_lm3d
 from face3d.models import networks
@@ -16,7 +15,8 @@ from utils.croper import Preprocesser
 
 import warnings
 
-from utils.safetensor_helper import load_x_from_safetensor 
+from utils.weights import load_safetensors, load_torch
+from utils.preprocess_cache import PreprocessCache
 warnings.filterwarnings("ignore")
 
 def split_coeff(coeffs):
@@ -44,22 +44,85 @@ def split_coeff(coeffs):
 
 
 class CropAndExtract():
-    def __init__(self, sadtalker_path, device):
+    def __init__(self, sadtalker_path, device, cache_dir=None, cache_max_bytes=2 * 1024 ** 3,
+                 recon_batch_size=32, align_workers=None):
 
         self.propress = Preprocesser(device)
         self.net_recon = networks.define_net_recon(net_recon='resnet50', use_last_fc=False, init_path='').to(device)
         
         if sadtalker_path['use_safetensor']:
-            checkpoint = safetensors.torch.load_file(sadtalker_path['checkpoint'])    
-            self.net_recon.load_state_dict(load_x_from_safetensor(checkpoint, 'face_3drecon'))
+            # only the face_3drecon tensors are read from the memory-mapped file
+            self.net_recon.load_state_dict(load_safetensors(sadtalker_path['checkpoint'], 'face_3drecon'))
         else:
-            checkpoint = torch.load(sadtalker_path['path_of_net_recon_model'], map_location=torch.device(device))    
+            checkpoint = load_torch(sadtalker_path['path_of_net_recon_model'], map_location=torch.device(device))    
             self.net_recon.load_state_dict(checkpoint['net_recon'])
 
         self.net_recon.eval()
         self.lm3d_std = load_lm3d(sadtalker_path['dir_of_BFM_fitting'])
         self.device = device
+        self.recon_batch_size = recon_batch_size
+        self.align_workers = align_workers or min(8, os.cpu_count() or 1)
+
+        if cache_dir is not None:
+            model_tag = os.path.basename(sadtalker_path['checkpoint'] if sadtalker_path['use_safetensor'] else sadtalker_path['path_of_net_recon_model'])
+            self.cache = PreprocessCache(cache_dir, max_bytes=cache_max_bytes, model_tag=model_tag)
+        else:
+            self.cache = None
     
+    def _align(self, frame, lm1):
+        W,H = frame.size
+        lm1 = lm1.reshape([-1, 2]).copy()
+
+        if np.mean(lm1) == -1:
+            lm1 = (self.lm3d_std[:, :2]+1)/2.
+            lm1 = np.concatenate(
+                [lm1[:, :1]*W, lm1[:, 1:2]*H], 1
+            )
+        else:
+            lm1[:, -1] = H - 1 - lm1[:, -1]
+
+        trans_params, im1, lm1, _ = align_img(frame, lm1, self.lm3d_std)
+        trans_params = np.array([float(item) for item in np.hsplit(trans_params, 5)]).astype(np.float32)
+        return trans_params, np.asarray(im1)
+
+    def extract_3dmm(self, frames_pil, lm):
+        """
+        Deep3DFaceRecon coefficients of every frame: (n, 73) exp/angle/trans/crop params and
+        the full (1, 257) coefficients of the first frame.
+
+        align_img runs on a thread pool one batch ahead of net_recon, which sees stacked
+        batches of recon_batch_size; results go straight into preallocated arrays.
+        """
+        n = len(frames_pil)
+        bs = self.recon_batch_size
+        semantic_npy = np.empty((n, 73), dtype=np.float32)
+        full_3dmm = None
+
+        with ThreadPoolExecutor(max_workers=self.align_workers) as pool:
+            def submit(start):
+                return [pool.submit(self._align, frames_pil[i], lm[i]) for i in range(start, min(start + bs, n))]
+
+            pending = submit(0)
+            for start in tqdm(range(0, n, bs), desc='3DMM Extraction In Video:'):
+                aligned = [f.result() for f in pending]
+                pending = submit(start + bs) if start + bs < n else []
+
+                end = start + len(aligned)
+                im_t = torch.from_numpy(np.stack([im for _, im in aligned])).to(self.device)
+                im_t = im_t.permute(0, 3, 1, 2).float().div_(255.)
+                with torch.no_grad():
+                    full_coeff = self.net_recon(im_t)
+                    coeffs = split_coeff(full_coeff)
+
+                semantic_npy[start:end, :64] = coeffs['exp'].cpu().numpy()
+                semantic_npy[start:end, 64:67] = coeffs['angle'].cpu().numpy()
+                semantic_npy[start:end, 67:70] = coeffs['trans'].cpu().numpy()
+                semantic_npy[start:end, 70:] = np.stack([trans_params[2:] for trans_params, _ in aligned])
+                if full_3dmm is None:
+                    full_3dmm = full_coeff[:1].cpu().numpy()
+
+        return semantic_npy, full_3dmm
+
     def generate(self, input_path, save_dir, crop_or_resize='crop', source_image_flag=False, pic_size=256):
 
         pic_name = os.path.splitext(os.path.split(input_path)[-1])[0]  
@@ -71,7 +134,17 @@ class CropAndExtract():
         #load input
         if not os.path.isfile(input_path):
             raise ValueError('input_path must be a valid path to video/image file')
-        elif input_path.split('.')[-1] in ['jpg', 'png', 'jpeg']:
+
+        # a known avatar skips detection, landmarks and the 3DMM fit entirely
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(input_path, crop_or_resize, source_image_flag, pic_size)
+            crop_info = self.cache.load(cache_key, png_path, landmarks_path, coeff_path)
+            if crop_info is not None:
+                print(' Using cached preprocessing.')
+                return coeff_path, png_path, crop_info
+
+        if input_path.split('.')[-1] in ['jpg', 'png', 'jpeg']:
             # loader for first frame
             full_frames = [cv2.imread(input_path)]
             fps = 25
@@ -129,42 +202,11 @@ class CropAndExtract():
 
         if not os.path.isfile(coeff_path):
             # load 3dmm paramter generator from Deep3DFaceRecon_pytorch 
-            video_coeffs, full_coeffs = [],  []
-            for idx in tqdm(range(len(frames_pil)), desc='3DMM Extraction In Video:'):
-                frame = frames_pil[idx]
-                W,H = frame.size
-                lm1 = lm[idx].reshape([-1, 2])
-            
-                if np.mean(lm1) == -1:
-                    lm1 = (self.lm3d_std[:, :2]+1)/2.
-                    lm1 = np.concatenate(
-                        [lm1[:, :1]*W, lm1[:, 1:2]*H], 1
-                    )
-                else:
-                    lm1[:, -1] = H - 1 - lm1[:, -1]
-
-                trans_params, im1, lm1, _ = align_img(frame, lm1, self.lm3d_std)
- 
-                trans_params = np.array([float(item) for item in np.hsplit(trans_params, 5)]).astype(np.float32)
-                im_t = torch.tensor(np.array(im1)/255., dtype=torch.float32).permute(2, 0, 1).to(self.device).unsqueeze(0)
-                
-                with torch.no_grad():
-                    full_coeff = self.net_recon(im_t)
-                    coeffs = split_coeff(full_coeff)
-
-                pred_coeff = {key:coeffs[key].cpu().numpy() for key in coeffs}
- 
-                pred_coeff = np.concatenate([
-                    pred_coeff['exp'], 
-                    pred_coeff['angle'],
-                    pred_coeff['trans'],
-                    trans_params[2:][None],
-                    ], 1)
-                video_coeffs.append(pred_coeff)
-                full_coeffs.append(full_coeff.cpu().numpy())
+            semantic_npy, full_3dmm = self.extract_3dmm(frames_pil, lm)
 
-            semantic_npy = np.array(video_coeffs)[:,0] 
+            savemat(coeff_path, {'coeff_3dmm': semantic_npy, 'full_3dmm': full_3dmm})
 
-            savemat(coeff_path, {'coeff_3dmm': semantic_npy, 'full_3dmm': np.array(full_coeffs)[0]})
+        if cache_key is not None:
+            self.cache.store(cache_key, crop_info, png_path, landmarks_path, coeff_path)
 
         return coeff_path, png_path, crop_info
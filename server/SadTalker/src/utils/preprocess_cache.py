@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# bump when the cached files or meta.json layout change; older entries are then ignored and evicted
+CACHE_VERSION = 1
+
+
+def _file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+class PreprocessCache():
+    """
+    On-disk cache of CropAndExtract.generate() results keyed by input content.
+
+    Each entry is a directory v<CACHE_VERSION>/<key>/ holding the cropped PNG,
+    the landmarks, the 3DMM .mat and a meta.json with crop_info. Entries are
+    published with an atomic rename, so several worker processes can share one
+    cache directory. When the cache grows past max_bytes the least recently
+    used entries are removed.
+    """
+
+    PNG, LANDMARKS, COEFF, META = 'crop.png', 'landmarks.txt', 'coeff.mat', 'meta.json'
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, model_tag=''):
+        self.root = os.path.abspath(root)
+        self.entry_root = os.path.join(self.root, 'v%d' % CACHE_VERSION)
+        self.max_bytes = max_bytes
+        self.model_tag = model_tag
+        self._lock = threading.Lock()
+        os.makedirs(self.entry_root, exist_ok=True)
+
+    def key(self, input_path, crop_or_resize, source_image_flag, pic_size):
+        h = hashlib.sha256()
+        h.update(_file_sha256(input_path).encode())
+        h.update(json.dumps([crop_or_resize.lower(), bool(source_image_flag), int(pic_size), self.model_tag]).encode())
+        return h.hexdigest()[:40]
+
+    def load(self, key, png_path, landmarks_path, coeff_path):
+        """ Copy a cached entry to the caller's paths and return its crop_info, or None on a miss. """
+        entry = os.path.join(self.entry_root, key)
+        try:
+            with open(os.path.join(entry, self.META)) as f:
+                meta = json.load(f)
+            if meta.get('version') != CACHE_VERSION:
+                return None
+            shutil.copyfile(os.path.join(entry, self.PNG), png_path)
+            shutil.copyfile(os.path.join(entry, self.LANDMARKS), landmarks_path)
+            shutil.copyfile(os.path.join(entry, self.COEFF), coeff_path)
+        except (OSError, ValueError):
+            return None
+        os.utime(entry)
+        return self._decode_crop_info(meta['crop_info'])
+
+    def store(self, key, crop_info, png_path, landmarks_path, coeff_path):
+        entry = os.path.join(self.entry_root, key)
+        if os.path.isdir(entry):
+            return
+        tmp = tempfile.mkdtemp(dir=self.entry_root, prefix='.tmp_')
+        try:
+            shutil.copyfile(png_path, os.path.join(tmp, self.PNG))
+            shutil.copyfile(landmarks_path, os.path.join(tmp, self.LANDMARKS))
+            shutil.copyfile(coeff_path, os.path.join(tmp, self.COEFF))
+            with open(os.path.join(tmp, self.META), 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'created': time.time(),
+                           'crop_info': self._encode_crop_info(crop_info)}, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # another process published the same key first, or the disk is unhappy; either way skip caching
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for e in os.scandir(self.entry_root):
+                if e.is_dir() and not e.name.startswith('.tmp_'):
+                    entries.append((e.stat().st_mtime, _dir_bytes(e.path), e.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            # drop entries written by older cache versions
+            for e in os.scandir(self.root):
+                if e.is_dir() and e.path != self.entry_root and e.name.startswith('v'):
+                    shutil.rmtree(e.path, ignore_errors=True)
+
+    @staticmethod
+    def _encode_crop_info(crop_info):
+        size, crop, quad = crop_info
+        return [list(size), None if crop is None else [int(v) for v in crop],
+                None if quad is None else [float(v) for v in quad]]
+
+    @staticmethod
+    def _decode_crop_info(data):
+        size, crop, quad = data
+        return (tuple(size), None if crop is None else tuple(crop), quad)
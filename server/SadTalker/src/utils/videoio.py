@@ -1,41 +1,188 @@
-import shutil
-import uuid
-
 import os
+import subprocess
+import threading
 
 import cv2
+import imageio_ffmpeg
 
-def load_video_to_cv2(input_path):
-    video_stream = cv2.VideoCapture(input_path)
-    fps = video_stream.get(cv2.CAP_PROP_FPS)
-    full_frames = [] 
-    while 1:
-        still_reading, frame = video_stream.read()
-        if not still_reading:
+class VideoFrames():
+    """
+    The frames of a video file as a re-iterable sequence with a known length.
+
+    Frames are decoded one at a time while iterating (nothing is kept in memory), so
+    full-resolution clips of any length can be pasted back or enhanced in bounded memory.
+    Frames are BGR as cv2 decodes them, or RGB with rgb=True.
+    """
+
+    def __init__(self, input_path, rgb=False):
+        self.input_path = input_path
+        self.rgb = rgb
+        video_stream = cv2.VideoCapture(input_path)
+        if not video_stream.isOpened():
+            raise ValueError('cannot open video %s' % input_path)
+        self.fps = video_stream.get(cv2.CAP_PROP_FPS)
+        self.length = int(video_stream.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.length <= 0:
+            # some containers do not store a frame count; grab() skips the decode
+            self.length = 0
+            while video_stream.grab():
+                self.length += 1
+        video_stream.release()
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        video_stream = cv2.VideoCapture(self.input_path)
+        try:
+            while 1:
+                still_reading, frame = video_stream.read()
+                if not still_reading:
+                    break
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if self.rgb else frame
+        finally:
             video_stream.release()
-            break 
-        full_frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    return full_frames
 
-def save_video_with_watermark(video, audio, save_path, watermark=False):
-    temp_file = str(uuid.uuid4())+'.mp4'
-    cmd = r'ffmpeg -y -hide_banner -loglevel error -i "%s" -i "%s" -vcodec copy "%s"' % (video, audio, temp_file)
-    os.system(cmd)
+def load_video_to_cv2(input_path):
+    return list(VideoFrames(input_path, rgb=True))
+
+class FFmpegWriter():
+    """
+    A persistent ffmpeg process that encodes raw frames written to its stdin.
+
+    Frames are (H, W, 3) uint8 arrays (pix_fmt 'rgb24' or 'bgr24') all of the same size;
+    they are piped to ffmpeg as soon as write() is called, so encoding overlaps with
+    whatever produces them and nothing but the pipe buffer is held in memory.
+
+    With audio_path the audio is decoded, resampled and muxed by the same process, so
+    the final container is written in one pass; duration (seconds) trims the output.
+    music_path is mixed under the audio at music_volume (amix, as the scene compositor did);
+    music_pcm=(sample_rate, channels) marks it as raw s16le PCM that needs no decoding.
+    close() waits for ffmpeg and raises RuntimeError with its stderr if anything failed.
+    """
+
+    def __init__(self, save_path, fps=25, audio_path=None, duration=None, pix_fmt='rgb24',
+                 codec='libx264', crf=18, preset='veryfast', audio_rate=16000, music_path=None, music_volume=0.28, music_pcm=None):
+        self.save_path = save_path
+        self.fps = fps
+        self.audio_path = audio_path
+        self.duration = duration
+        self.pix_fmt = pix_fmt
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.audio_rate = audio_rate
+        self.music_path = music_path
+        self.music_volume = music_volume
+        self.music_pcm = music_pcm
+        self.frame_size = None
+        self.frames = 0
+        self._proc = None
+        self._stderr = []
+        self._stderr_thread = None
+
+    def _command(self, width, height):
+        cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', self.pix_fmt, '-s', '%dx%d' % (width, height), '-r', str(self.fps), '-i', 'pipe:0']
+        if self.audio_path and self.music_path:
+            cmd += ['-i', self.audio_path]
+            if self.music_pcm:
+                cmd += ['-f', 's16le', '-ar', str(self.music_pcm[0]), '-ac', str(self.music_pcm[1])]
+            cmd += ['-i', self.music_path,
+                    '-filter_complex', '[2:a]volume=%s[music];[1:a][music]amix=inputs=2:duration=first:dropout_transition=2[aout]' % self.music_volume,
+                    '-map', '0:v:0', '-map', '[aout]', '-c:a', 'aac']
+        elif self.audio_path:
+            cmd += ['-i', self.audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c:a', 'aac', '-ar', str(self.audio_rate)]
+        # yuv420p needs even dimensions; the aspect-ratio resize can produce odd heights
+        cmd += ['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+                '-c:v', self.codec, '-crf', str(self.crf), '-preset', self.preset, '-pix_fmt', 'yuv420p']
+        if self.duration is not None:
+            cmd += ['-t', '%.3f' % self.duration]
+        return cmd + [self.save_path]
 
+    def _open(self, width, height):
+        self._proc = subprocess.Popen(self._command(width, height), stdin=subprocess.PIPE,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        # drain stderr on a thread so a chatty ffmpeg can never block on a full pipe
+        self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_thread.start()
+        self.frame_size = (width, height)
+
+    def _read_stderr(self):
+        for line in iter(self._proc.stderr.readline, b''):
+            self._stderr.append(line.decode(errors='replace'))
+            del self._stderr[:-50]
+
+    def write(self, frame):
+        height, width = frame.shape[:2]
+        if self._proc is None:
+            self._open(width, height)
+        elif (width, height) != self.frame_size:
+            raise ValueError('frame size %dx%d does not match %dx%d' % ((width, height) + self.frame_size))
+        try:
+            self._proc.stdin.write(frame.astype('uint8', copy=False).tobytes())
+        except (BrokenPipeError, OSError):
+            # ffmpeg exited early; close() raises with its stderr
+            self.close()
+            raise
+        self.frames += 1
+
+    def close(self):
+        if self._proc is None:
+            if self.frames == 0:
+                raise RuntimeError('no frames were written to %s' % self.save_path)
+            return
+        proc, self._proc = self._proc, None
+        try:
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = proc.wait()
+        self._stderr_thread.join()
+        if returncode != 0:
+            raise RuntimeError('ffmpeg failed writing %s (exit %d): %s' % (self.save_path, returncode, ''.join(self._stderr).strip()))
+
+    def abort(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+        if os.path.exists(self.save_path):
+            os.remove(self.save_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def _watermark_path():
+    try:
+        ##### check if stable-diffusion-webui
+        import webui
+        from modules import paths
+        return paths.script_path+"/extensions/SadTalker/docs/sadtalker_logo.png"
+    except:
+        # get the root path of sadtalker.
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        return dir_path+"/../../docs/sadtalker_logo.png"
+
+def save_video_with_watermark(video, audio, save_path, watermark=False, duration=None):
+    """ Mux audio into video (and optionally overlay the logo) with a single ffmpeg call writing save_path. """
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-hide_banner', '-loglevel', 'error', '-i', video, '-i', audio]
     if watermark is False:
-        shutil.move(temp_file, save_path)
+        cmd += ['-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy']
     else:
-        # watermark
-        try:
-            ##### check if stable-diffusion-webui
-            import webui
-            from modules import paths
-            watarmark_path = paths.script_path+"/extensions/SadTalker/docs/sadtalker_logo.png"
-        except:
-            # get the root path of sadtalker.
-            dir_path = os.path.dirname(os.path.realpath(__file__))
-            watarmark_path = dir_path+"/../../docs/sadtalker_logo.png"
-
-        cmd = r'ffmpeg -y -hide_banner -loglevel error -i "%s" -i "%s" -filter_complex "[1]scale=100:-1[wm];[0][wm]overlay=(main_w-overlay_w)-10:10" "%s"' % (temp_file, watarmark_path, save_path)
-        os.system(cmd)
-        os.remove(temp_file)
\ No newline at end of file
+        cmd += ['-i', _watermark_path(),
+                '-filter_complex', '[2]scale=100:-1[wm];[0:v][wm]overlay=(main_w-overlay_w)-10:10[vout]',
+                '-map', '[vout]', '-map', '1:a:0']
+    if duration is not None:
+        cmd += ['-t', '%.3f' % duration]
+    cmd.append(save_path)
+
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError('ffmpeg failed writing %s (exit %d): %s' % (save_path, proc.returncode, proc.stderr.decode(errors='replace').strip()))
@@ -0,0 +1,232 @@
+"""
+Local weight registry: every model file the pipeline loads, resolved from one directory.
+
+Nothing in here touches the network. server/download_checkpoints.py is the only place
+that fetches weights; it also writes the weights.sha256 manifest (sha256sum format,
+paths relative to the weights directory) that files are checked against here. A missing
+or corrupt file raises MissingWeightsError with a report of everything that is wrong,
+before any model is built, instead of hanging on a download in an air-gapped worker.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+SADTALKER_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+WEIGHTS_DIR = os.environ.get('SADTALKER_WEIGHTS_DIR', os.path.join(SADTALKER_ROOT, 'checkpoints'))
+# hash every weight file against the manifest (once per file and mtime, remembered on disk)
+VERIFY_WEIGHTS = os.environ.get('SADTALKER_VERIFY_WEIGHTS', '1') == '1'
+MANIFEST_NAME = 'weights.sha256'
+_VERIFIED_NAME = '.weights.verified.json'
+
+# face alignment / detection / parsing and enhancer weights: registry name -> (file name, source url).
+# The urls are only read by download_checkpoints.py.
+AUX_MODELS = {
+    'alignment_WFLW_4HG': ('alignment_WFLW_4HG.pth', 'https://github.com/xinntao/facexlib/releases/download/v0.1.0/alignment_WFLW_4HG.pth'),
+    'detection_Resnet50_Final': ('detection_Resnet50_Final.pth', 'https://github.com/xinntao/facexlib/releases/download/v0.1.0/detection_Resnet50_Final.pth'),
+    'parsing_parsenet': ('parsing_parsenet.pth', 'https://github.com/xinntao/facexlib/releases/download/v0.2.2/parsing_parsenet.pth'),
+    'GFPGANv1.4': ('GFPGANv1.4.pth', 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth'),
+    'RestoreFormer': ('RestoreFormer.pth', 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/RestoreFormer.pth'),
+    'RealESRGAN_x2plus': ('RealESRGAN_x2plus.pth', 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth'),
+}
+
+# weights every render needs besides the SadTalker checkpoints themselves
+FACE_MODELS = ['alignment_WFLW_4HG', 'detection_Resnet50_Final']
+ENHANCER_MODELS = {'gfpgan': ['GFPGANv1.4', 'detection_Resnet50_Final', 'parsing_parsenet'],
+                   'RestoreFormer': ['RestoreFormer', 'detection_Resnet50_Final', 'parsing_parsenet']}
+
+WEIGHT_EXTENSIONS = ('.pth', '.tar', '.safetensors', '.pt', '.onnx', '.dat')
+
+
+class MissingWeightsError(FileNotFoundError):
+    """ Raised before loading when weights are missing or fail their checksum; .report has the details. """
+
+    def __init__(self, root, report):
+        self.root = root
+        self.report = report
+        lines = ['model weights are not usable (weights dir: %s, nothing is downloaded at runtime;'
+                 ' run server/download_checkpoints.py where the network is available):' % root]
+        for name, entry in report.items():
+            if entry['status'] not in ('ok', 'unlisted'):
+                lines.append('  %-28s %-18s %s' % (name, entry['status'], entry['path']))
+        super().__init__('\n'.join(lines))
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """ {relative path: sha256} from a sha256sum-style file; {} when there is none. """
+    manifest = {}
+    if not os.path.isfile(path):
+        return manifest
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            digest, name = line.split(None, 1)
+            manifest[os.path.normpath(name.lstrip('*'))] = digest.lower()
+    return manifest
+
+
+def _write_atomic(path, write):
+    # a private temp file per writer: concurrent workers never share or rename a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_manifest(path, entries):
+    def write(f):
+        for name in sorted(entries):
+            f.write('%s  %s\n' % (entries[name], name.replace(os.sep, '/')))
+    _write_atomic(path, write)
+
+
+class WeightRegistry():
+    def __init__(self, root=WEIGHTS_DIR, verify=VERIFY_WEIGHTS, search=None):
+        self.root = os.path.abspath(root)
+        self.verify = verify
+        # the pre-registry location of the face / enhancer weights, still honoured when the file is not in root
+        self.search = [self.root] + [os.path.abspath(d) for d in (search if search is not None else ['gfpgan/weights'])]
+        self._manifest = None
+        self._verified = None
+        self._lock = threading.Lock()
+
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = read_manifest(os.path.join(self.root, MANIFEST_NAME))
+        return self._manifest
+
+    def path(self, name):
+        """ Absolute path of a registry name, or of a file name / path under the weights dir. """
+        if name in AUX_MODELS:
+            file_name = AUX_MODELS[name][0]
+            for directory in self.search:
+                candidate = os.path.join(directory, file_name)
+                if os.path.isfile(candidate):
+                    return candidate
+            return os.path.join(self.root, file_name)
+        return name if os.path.isabs(name) else os.path.join(self.root, name)
+
+    def _relative(self, path):
+        rel = os.path.relpath(path, self.root)
+        return None if rel.startswith('..') else os.path.normpath(rel)
+
+    def _load_verified(self):
+        if self._verified is None:
+            try:
+                with open(os.path.join(self.root, _VERIFIED_NAME)) as f:
+                    self._verified = json.load(f)
+            except (OSError, ValueError):
+                self._verified = {}
+        return self._verified
+
+    def _save_verified(self):
+        path = os.path.join(self.root, _VERIFIED_NAME)
+        try:
+            _write_atomic(path, lambda f: json.dump(self._verified, f))
+        except OSError:
+            pass  # read-only weights dir: verify again in the next process
+
+    def _check_one(self, path):
+        if not os.path.isfile(path):
+            return {'path': path, 'status': 'missing'}
+        rel = self._relative(path)
+        expected = self.manifest().get(rel) if rel else None
+        if expected is None:
+            return {'path': path, 'status': 'unlisted'}
+        if not self.verify:
+            return {'path': path, 'status': 'ok'}
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, expected]
+        verified = self._load_verified()
+        if verified.get(rel) == stamp:
+            return {'path': path, 'status': 'ok'}
+        actual = sha256_file(path)
+        if actual != expected:
+            return {'path': path, 'status': 'checksum_mismatch', 'expected': expected, 'actual': actual}
+        verified[rel] = stamp
+        self._save_verified()
+        return {'path': path, 'status': 'ok'}
+
+    def check(self, entries):
+        """
+        entries: registry names, or a {label: path} dict. Returns {label: {"path", "status"}} with
+        status ok, unlisted (present but not in the manifest), missing or checksum_mismatch.
+        """
+        if not isinstance(entries, dict):
+            entries = {name: self.path(name) for name in entries}
+        with self._lock:
+            return {label: self._check_one(os.path.abspath(path)) for label, path in entries.items()}
+
+    def require(self, entries):
+        """ check(), raising MissingWeightsError unless everything is usable; returns {label: path}. """
+        report = self.check(entries)
+        if any(entry['status'] not in ('ok', 'unlisted') for entry in report.values()):
+            raise MissingWeightsError(self.root, report)
+        return {label: entry['path'] for label, entry in report.items()}
+
+    def resolve(self, name):
+        return self.require([name])[name]
+
+
+def sadtalker_weights(sadtalker_paths):
+    """ {label: path} of the SadTalker checkpoint files a variant from init_path loads. """
+    keys = ['audio2pose_checkpoint', 'audio2exp_checkpoint', 'mappingnet_checkpoint']
+    if sadtalker_paths.get('use_safetensor'):
+        keys.append('checkpoint')
+    else:
+        keys += ['free_view_checkpoint', 'path_of_net_recon_model']
+    return {key: sadtalker_paths[key] for key in keys}
+
+
+_registry = None
+
+
+def get_weight_registry():
+    global _registry
+    if _registry is None:
+        _registry = WeightRegistry()
+    return _registry
+
+
+def load_safetensors(path, prefix=None, device='cpu'):
+    """
+    Tensors of a safetensors file, memory-mapped: only the keys under prefix are read
+    (with the prefix stripped, like load_x_from_safetensor) instead of the whole file.
+    """
+    from safetensors import safe_open
+    tensors = {}
+    with safe_open(path, framework='pt', device=device) as f:
+        for k in f.keys():
+            if prefix is None:
+                tensors[k] = f.get_tensor(k)
+            elif prefix in k:
+                tensors[k.replace(prefix + '.', '')] = f.get_tensor(k)
+    return tensors
+
+
+def load_torch(path, map_location='cpu'):
+    """ torch.load, memory-mapped when the checkpoint format and torch version allow it. """
+    import torch
+    try:
+        return torch.load(path, map_location=map_location, mmap=True)
+    except (TypeError, RuntimeError):
+        # torch < 2.1 has no mmap; legacy (non-zip) checkpoints cannot be mapped
+        return torch.load(path, map_location=map_location)
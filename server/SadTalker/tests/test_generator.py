@@ -0,0 +1,86 @@
+"""
+decode(encode_source(x)) must render exactly what the single-pass forward() rendered
+before the generator was split, with and without a dense motion network.
+"""
+import os, sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+F = torch.nn.functional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from facerender.modules.generator import OcclusionAwareGenerator, OcclusionAwareSPADEGenerator
+
+NUM_KP = 15
+DENSE_MOTION_PARAMS = {'block_expansion': 8, 'max_features': 32, 'num_blocks': 2, 'reshape_depth': 16, 'compress': 2}
+
+
+def reference_forward(generator, source_image, kp_driving, kp_source):
+    """ The generators' forward() from before encode_source / decode existed. """
+    out = generator.first(source_image)
+    for i in range(len(generator.down_blocks)):
+        out = generator.down_blocks[i](out)
+    out = generator.second(out)
+    bs, c, h, w = out.shape
+    feature_3d = out.view(bs, generator.reshape_channel, generator.reshape_depth, h, w)
+    feature_3d = generator.resblocks_3d(feature_3d)
+
+    output_dict = {}
+    if generator.dense_motion_network is not None:
+        dense_motion = generator.dense_motion_network(feature=feature_3d, kp_driving=kp_driving, kp_source=kp_source)
+        output_dict['mask'] = dense_motion['mask']
+        occlusion_map = dense_motion.get('occlusion_map')
+        out = generator.deform_input(feature_3d, dense_motion['deformation'])
+        bs, c, d, h, w = out.shape
+        out = out.view(bs, c*d, h, w)
+        out = generator.third(out)
+        out = generator.fourth(out)
+        if occlusion_map is not None:
+            if out.shape[2] != occlusion_map.shape[2] or out.shape[3] != occlusion_map.shape[3]:
+                occlusion_map = F.interpolate(occlusion_map, size=out.shape[2:], mode='bilinear')
+            out = out * occlusion_map
+
+    if isinstance(generator, OcclusionAwareSPADEGenerator):
+        out = generator.decoder(out)
+    else:
+        out = generator.resblocks_2d(out)
+        for i in range(len(generator.up_blocks)):
+            out = generator.up_blocks[i](out)
+        out = F.sigmoid(generator.final(out))
+    output_dict['prediction'] = out
+    return output_dict
+
+
+def make_generator(cls, dense_motion):
+    torch.manual_seed(0)
+    if cls is OcclusionAwareSPADEGenerator:
+        # SPADEDecoder takes 256 channels: max_features without dense motion, block_expansion * 4 with it
+        kwargs = dict(block_expansion=64, max_features=256, reshape_channel=16)
+    else:
+        kwargs = dict(block_expansion=16, max_features=64, reshape_channel=4)
+    generator = cls(image_channel=3, feature_channel=kwargs['reshape_channel'], num_kp=NUM_KP, num_down_blocks=2,
+                    reshape_depth=16, num_resblocks=2, estimate_occlusion_map=True,
+                    dense_motion_params=DENSE_MOTION_PARAMS if dense_motion else None, **kwargs)
+    return generator.eval()
+
+
+@pytest.mark.parametrize("cls", [OcclusionAwareGenerator, OcclusionAwareSPADEGenerator])
+@pytest.mark.parametrize("dense_motion", [False, True])
+def test_decode_of_encoded_source_matches_forward(cls, dense_motion):
+    generator = make_generator(cls, dense_motion)
+    torch.manual_seed(1)
+    source_image = torch.rand(2, 3, 64, 64)
+    kp_source = {'value': torch.rand(2, NUM_KP, 3) * 2 - 1}
+    kp_driving = {'value': torch.rand(2, NUM_KP, 3) * 2 - 1}
+
+    with torch.no_grad():
+        expected = reference_forward(generator, source_image, kp_driving, kp_source)
+        actual = generator.decode(generator.encode_source(source_image), kp_driving, kp_source)
+        chained = generator(source_image, kp_driving, kp_source)
+
+    assert set(actual) == set(expected)
+    for key in expected:
+        torch.testing.assert_close(actual[key], expected[key])
+        torch.testing.assert_close(chained[key], expected[key])
@@ -1,20 +1,15 @@
 from flask import Flask, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from rembg import remove
-from PIL import Image
-import os, sys, logging, traceback, shutil, subprocess
+import os, logging, traceback, shutil, threading, time
+import multiprocessing
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SADTALKER_DIR = os.path.join(BASE_DIR, "SadTalker", "src")
-# === Setup Python paths ===
-sys.path.append(SADTALKER_DIR)
-sys.path.append(os.path.join(SADTALKER_DIR, "utils"))
-
-from utils.init_path import init_path
-
-# Load SadTalker paths once
-sadtalker_paths = init_path()
+from pipeline import sadtalker_paths
+from bg_removal import BackgroundRemover
+from jobs import JobManager, QueueFullError, WorkerPoolError, DONE, FAILED
+from artifacts import ArtifactStore, file_digest
+from tts_cache import TTSCache
+from tts_engine import TTSEngine, SPLITTER_VERSION
 
 print("[DEBUG] Checking checkpoints folder at:", sadtalker_paths["checkpoints_dir"])
 if os.path.exists(sadtalker_paths["checkpoints_dir"]):
@@ -48,22 +43,81 @@ os.makedirs(AVATAR_FOLDER, exist_ok=True)
 os.makedirs(SADTALKER_RESULTS, exist_ok=True)
 print(f"[INIT] Output folders ready: {OUTPUT_FOLDER}, {AVATAR_FOLDER}, {SADTALKER_RESULTS}")
 
-# === Lazy-loaded global instances ===
-tts = None
-sadtalker = None
-print("[INIT] Lazy-load variables initialized")
-
-# === Helper to remove avatar background ===
-def remove_avatar_background(input_path, output_path):
-    print(f"[BG-REMOVE] Removing background from {input_path}")
+# === Artifact store (content-addressed outputs + per-job work dirs, TTL cleanup) ===
+ARTIFACT_ROOT = os.path.join(OUTPUT_FOLDER, "artifacts")
+artifact_store = ArtifactStore(ARTIFACT_ROOT)
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public")
+
+# === Synthesized speech cache (normalized text + model + voice -> wav) ===
+TTS_MODEL_NAME = "tts_models/en/ljspeech/tacotron2-DDC"
+tts_cache = TTSCache(os.path.join(OUTPUT_FOLDER, "cache", "tts"))
+
+# === Sentence-parallel TTS; worker processes load the model on first use ===
+tts_engine = TTSEngine(TTS_MODEL_NAME, cache=tts_cache)
+
+# === Eager warmup: load every model in the background so the first request is not a cold start ===
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "1") == "1"
+
+# === Job workers (SadTalker + ffmpeg run here, not in request threads) ===
+job_manager = JobManager(warmup="warmup" if WARMUP_ON_START else None)
+
+# === Background removal workers: one warm rembg session each, kept apart from the long video jobs ===
+BG_REMOVAL_WORKERS = int(os.environ.get("BG_REMOVAL_WORKERS", 1))
+BG_REMOVAL_MAX_QUEUE = int(os.environ.get("BG_REMOVAL_MAX_QUEUE", 32))
+# how long an avatar request waits for its removal job before answering 202 with a job to poll
+BG_REMOVAL_WAIT_SECONDS = float(os.environ.get("BG_REMOVAL_WAIT_SECONDS", 15))
+bg_job_manager = JobManager(max_workers=BG_REMOVAL_WORKERS, max_queue=BG_REMOVAL_MAX_QUEUE,
+                            warmup="warmup_background_removal" if WARMUP_ON_START else None)
+bg_remover = BackgroundRemover()
+warmup_status = {"tts": {"status": "pending"}}
+
+def _warm_tts():
+    warmup_status["tts"] = {"status": "loading", "started_at": time.time()}
+    start = time.time()
     try:
-        input_image = Image.open(input_path).convert("RGBA")
-        output_image = remove(input_image)
-        output_image.save(output_path)
-        print(f"[BG-REMOVE] Saved processed image to {output_path}")
+        sample_rate = tts_engine.warmup()
+        warmup_status["tts"] = {"status": "ok", "seconds": round(time.time() - start, 3),
+                                "workers": tts_engine.workers, "sample_rate": sample_rate}
+        print(f"[WARMUP] TTS warm in {warmup_status['tts']['seconds']}s")
     except Exception as e:
-        print(f"[ERROR] Background removal failed: {e}")
-        raise
+        logging.error(f"TTS warmup failed: {str(e)}\n{traceback.format_exc()}")
+        warmup_status["tts"] = {"status": "error", "seconds": round(time.time() - start, 3), "error": str(e)}
+
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+def start_warmup():
+    """ Start warming every model in the background; runs once per process. """
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    print("[WARMUP] Warming TTS and SadTalker workers in the background...")
+    threading.Thread(target=_warm_tts, name="tts-warmup", daemon=True).start()
+    job_manager.start()
+    bg_job_manager.start()
+
+def _remove_backgrounds(items):
+    """
+    Cache hits are answered in the request thread; misses run as one batch in the
+    background-removal workers. Returns None when every result is ready, or the
+    still-running Job after BG_REMOVAL_WAIT_SECONDS. Raises QueueFullError,
+    WorkerPoolError or RuntimeError.
+    """
+    misses = [(src, dest) for src, dest in items if not bg_remover.restore(src, dest)]
+    if not misses:
+        return None
+    job = bg_job_manager.submit("remove_backgrounds", items=misses)
+    bg_job_manager.wait(job, BG_REMOVAL_WAIT_SECONDS)
+    if job.status == FAILED:
+        raise RuntimeError(job.error or "Background removal failed")
+    return None if job.status == DONE else job
+
+def _bg_job_response(job, paths):
+    """ 202 body for a removal job that outlived the request; paths are served once status_url reports done. """
+    return jsonify({"success": True, "pending": True, "paths": paths, "job_id": job.id,
+                    "status_url": f"/jobs/background-removal/{job.id}"}), 202
 
 # === Routes ===
 @app.route("/upload-avatar", methods=["POST"])
@@ -78,10 +132,15 @@ def upload_avatar():
         logging.error("Upload avatar failed: Empty filename")
         return jsonify({"success": False, "error": "Empty filename"}), 400
 
-    # Save the original file
-    filename = secure_filename(file.filename)
+    # Save the original file under its content hash so different uploads never collide
+    _, ext = os.path.splitext(secure_filename(file.filename))
+    work_dir = artifact_store.new_work_dir("upload")
+    upload_path = os.path.join(work_dir, "upload" + ext.lower())
+    file.save(upload_path)
+    filename = file_digest(upload_path)[:32] + ext.lower()
     filepath = os.path.join(AVATAR_FOLDER, filename)
-    file.save(filepath)
+    os.replace(upload_path, filepath)
+    shutil.rmtree(work_dir, ignore_errors=True)
     print(f"[UPLOAD] Avatar saved to {filepath}")
 
     try:
@@ -90,9 +149,15 @@ def upload_avatar():
         transparent_filename = f"transparent_{base}.png"
         transparent_path = os.path.join(AVATAR_FOLDER, transparent_filename)
 
-        remove_avatar_background(filepath, transparent_path)
+        job = _remove_backgrounds([(filepath, transparent_path)])
+        if job is not None:
+            return _bg_job_response(job, [f"/avatars/{transparent_filename}"])
 
         return jsonify({"success": True, "path": f"/avatars/{transparent_filename}"})
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": f"Server busy: {e}"}), 429
+    except WorkerPoolError as e:
+        return jsonify({"success": False, "error": f"Workers unavailable: {e}"}), 503
     except Exception as e:
         logging.error(f"Background removal failed: {str(e)}\n{traceback.format_exc()}")
         return jsonify({"success": False, "error": "Background removal failed"}), 500
@@ -105,221 +170,158 @@ def serve_avatar(filename):
 @app.route("/generate-audio", methods=["POST"])
 def generate_audio():
     print("[ROUTE] /generate-audio called")
-    global tts
-    if tts is None:
-        print("[TTS] Initializing TTS...")
-        try:
-            from TTS.api import TTS
-            from TTS.utils.audio import processor
-            _original_init = processor.AudioProcessor.__init__
-
-            def fast_load_init(self, *args, fast_load=True, **kwargs):
-                self.fast_load = fast_load
-                _original_init(self, *args, **kwargs)
-                if self.fast_load:
-                    self.mel_basis = None
-                    self.stft = None
-
-            processor.AudioProcessor.__init__ = fast_load_init
-            tts = TTS(model_name="tts_models/en/ljspeech/tacotron2-DDC", progress_bar=False, gpu=False)
-            print("[TTS] TTS initialized successfully")
-        except Exception as e:
-            logging.error(f"Failed to initialize TTS: {str(e)}\n{traceback.format_exc()}")
-            return jsonify({"success": False, "error": "Failed to initialize TTS"}), 500
-
     data = request.get_json()
     text = data.get("text", "")
     if not text.strip():
         return jsonify({"success": False, "error": "No text provided"}), 400
 
-    output_file = os.path.join(OUTPUT_FOLDER, "output.wav")
+    # Repeated lines (templated intros/outros) are served from the cache without touching the model.
+    # The stitched wav depends on the pause and the sentence splitting too, and must not share
+    # keys with the sentence-level entries TTSEngine keeps in the same cache
+    cache_key = tts_cache.key(text, TTS_MODEL_NAME, kind="script", pause=tts_engine.pause, splitter=SPLITTER_VERSION)
+    cached_path = tts_cache.get(cache_key)
+    if cached_path is not None:
+        audio_name = artifact_store.put_file(cached_path)
+        print(f"[TTS] Cache hit {cache_key[:12]} -> artifact {audio_name}")
+        return jsonify({"success": True, "url": f"/audio/{audio_name}", "audio": audio_name, "cached": True})
+
+    work_dir = artifact_store.new_work_dir("tts")
+    output_file = os.path.join(work_dir, "output.wav")
     try:
-        tts.tts_to_file(text=text, file_path=output_file)
-        print(f"[TTS] Audio saved to {output_file}")
-        return jsonify({"success": True, "url": "/audio/output.wav"})
+        # sentences are synthesized in parallel and cached one by one, then joined with fixed pauses
+        sentences = tts_engine.synthesize_to_file(text, output_file)
+        tts_cache.put(cache_key, output_file)
+        audio_name = artifact_store.put_file(output_file, move=True)
+        print(f"[TTS] Audio saved as artifact {audio_name} ({sentences} sentence(s), cache miss {cache_key[:12]})")
+        return jsonify({"success": True, "url": f"/audio/{audio_name}", "audio": audio_name, "cached": False})
     except Exception as e:
         logging.error(f"TTS generation error: {str(e)}\n{traceback.format_exc()}")
         return jsonify({"success": False, "error": "Text-to-speech generation failed"}), 500
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+@app.route("/tts-cache/stats")
+def tts_cache_stats():
+    return jsonify({"success": True, **tts_cache.stats()})
 
 @app.route("/audio/<filename>")
 def serve_audio(filename):
     print(f"[ROUTE] Serving audio: {filename}")
-    return send_from_directory(OUTPUT_FOLDER, filename)
+    path = artifact_store.path(filename)
+    if path is None:
+        return jsonify({"success": False, "error": "Audio not found"}), 404
+    return send_file(path, mimetype="audio/wav")
 
 # === Updated generate-video route with overlay + music mix ===
+def _video_response(result):
+    return {"success": True, "video": result["video"], "video_path": f"/video/{result['video']}"}
+
+def _resolve_scene_asset(value, kind):
+    """ Scene assets may be given as artifact names or public asset names/paths (as /select-scene-assets returns). """
+    if not value:
+        return None
+    path = artifact_store.path(os.path.basename(value))
+    if path is None:
+        candidate = os.path.join(PUBLIC_DIR, kind, os.path.basename(value))
+        path = os.path.abspath(candidate) if os.path.exists(candidate) else None
+    return path
+
+def _video_job_kwargs(data):
+    data = data or {}
+    audio = data.get("audio") or os.path.basename(data.get("audioPath") or "")
+    return {
+        "avatar_filename": data.get("avatar"),
+        "audio_path": artifact_store.path(audio),
+        "avatar_folder": AVATAR_FOLDER,
+        "artifact_root": ARTIFACT_ROOT,
+        "work_dir": artifact_store.new_work_dir("video"),
+        "background_path": _resolve_scene_asset(data.get("background"), "backgrounds"),
+        "music_path": _resolve_scene_asset(data.get("music"), "music"),
+    }
+
+def _submit_video_job(data):
+    """ Submit a generate_video job; its work dir is removed again if the job is not admitted. """
+    kwargs = _video_job_kwargs(data)
+    try:
+        return job_manager.submit("generate_video", **kwargs)
+    except Exception:
+        shutil.rmtree(kwargs["work_dir"], ignore_errors=True)
+        raise
+
 @app.route("/generate-video", methods=["POST"])
 def generate_video():
+    """ Synchronous wrapper kept for the current frontend: submits a job and waits for it. """
     print("[ROUTE] /generate-video called")
-    global sadtalker
-
-    # Initialize SadTalker if not already
-    if sadtalker is None:
-        print("[SADTALKER] Initializing SadTalker...")
-        try:
-            from gradio_demo import SadTalker
-            sadtalker = SadTalker(
-                checkpoint_path=sadtalker_paths["checkpoints_dir"],
-                config_path=sadtalker_paths["config_dir"],
-                lazy_load=False
-            )
-            print("[SADTALKER] Initialized successfully")
-        except Exception as e:
-            print("[ERROR] Failed to init SadTalker:", e)
-            traceback.print_exc()
-            return jsonify({"error": str(e)}), 500
-
+    data = request.get_json()
     try:
-        data = request.get_json()
-        avatar_filename = data.get("avatar")
-        mode = data.get("mode", "full")
-
-        if not avatar_filename:
-            return jsonify({"success": False, "error": "No avatar filename provided"}), 400
-
-        avatar_rel = avatar_filename.replace("/avatars/", "")
-
-        uploaded_avatar_path = os.path.join(AVATAR_FOLDER, avatar_rel)
-        preloaded_avatar_path = os.path.join(os.path.dirname(BASE_DIR), "public", "avatars", avatar_rel)
-
-        if os.path.exists(uploaded_avatar_path):
-            source_path = uploaded_avatar_path
-            print(f"[DEBUG] Using uploaded avatar: {source_path}")
-        elif os.path.exists(preloaded_avatar_path):
-            source_path = preloaded_avatar_path
-            print(f"[DEBUG] Using preloaded avatar: {source_path}")
-        else:
-            return jsonify({"success": False, "error": f"Avatar not found: {avatar_rel}"}), 404
-
-        # ensure a transparent PNG exists (created earlier by remove_avatar_background)
-        transparent_filename = f"transparent_{avatar_rel}"
-        transparent_path = os.path.join(AVATAR_FOLDER, transparent_filename)
-        if not os.path.exists(transparent_path):
-            print(f"[BG-REMOVE] Generating transparent avatar: {transparent_filename}")
-            remove_avatar_background(source_path, transparent_path)
-        else:
-            print(f"[BG-REMOVE] Transparent avatar already exists: {transparent_filename}")
-
-        avatar_full = transparent_path
-        print(f"[DEBUG] Avatar to use for SadTalker: {avatar_full}")
-
-        # Ensure TTS audio exists
-        audio_path = os.path.join(OUTPUT_FOLDER, "output.wav")
-        if not os.path.exists(audio_path):
-            return jsonify({"success": False, "error": "Audio file not found"}), 404
-
-        # Run SadTalker -> produces a video (usually in results/<uuid>/transparent_<name>__output.mp4)
-        print("[SADTALKER] Running test()...")
-        video_path = sadtalker.test(
-            source_image=avatar_full,
-            driven_audio=audio_path,
-            preprocess='crop',
-            still_mode=False,
-            use_enhancer=False,
-            batch_size=1,
-            size=256
-        )
-        video_path = os.path.abspath(video_path)
-        print(f"[SADTALKER] Video generated at {video_path}")
-
-        # Prepare final composite
-        final_path = os.path.join(OUTPUT_FOLDER, "final_video.mp4")
-        background_path = os.path.join(OUTPUT_FOLDER, "background.png")
-        music_path = os.path.join(OUTPUT_FOLDER, "music.mp3")
-
-        if not (os.path.exists(background_path) and os.path.exists(music_path)):
-            print("[WARN] Missing background.png or music.mp3, returning raw SadTalker video")
-            return jsonify({"success": True, "video_path": video_path})
-
-        # avatar_full is the transparent PNG produced earlier (output/avatars/transparent_*.png)
-        avatar_png = os.path.abspath(avatar_full)
-        if not os.path.exists(avatar_png):
-            print(f"[ERROR] Transparent PNG not found at {avatar_png}; falling back to simple overlay without feather.")
-            # fallback simple overlay using the SadTalker video directly
-            ffmpeg_cmd = [
-                "ffmpeg", "-y",
-                "-i", background_path,
-                "-i", video_path,
-                "-i", music_path,
-                "-filter_complex",
-                (
-                    "[1:v]scale=550:-1[avatar];"
-                    "[2:a]volume=0.3[music];"
-                    "[0:v][avatar]overlay=(W-w)/2:H-h-200[vout];"
-                    "[1:a][music]amix=inputs=2:duration=first:dropout_transition=2[aout]"
-                ),
-                "-map", "[vout]",
-                "-map", "[aout]",
-                "-c:v", "libx264",
-                "-crf", "18",
-                "-preset", "veryfast",
-                "-c:a", "aac",
-                "-shortest",
-                final_path
-            ]
-            print("[FFMPEG] Running fallback overlay (no feather)...")
-            subprocess.run(ffmpeg_cmd, check=True)
-            print(f"[FFMPEG] Final video ready at {final_path}")
-            return jsonify({"success": True, "video_path": f"/video/{os.path.basename(final_path)}"})
-
-        # ---- MAIN: use PNG mask + SadTalker video to produce feathered avatar ----
-        # Inputs order: [0]=background, [1]=video, [2]=avatar_png, [3]=music
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-i", background_path,    # 0
-            "-i", video_path,         # 1
-            "-i", avatar_png,         # 2 (transparent PNG created by remove_avatar_background)
-            "-i", music_path,         # 3
-            "-filter_complex",
-            (
-                # scale the SadTalker rendered frames (video) and make RGBA
-                "[1:v]scale=550:-1,format=rgba[vid_rgba];"
-                # scale the source PNG to exactly the same size and keep RGBA
-                "[2:v]scale=550:-1,format=rgba[png_rgba];"
-                # extract alpha from the scaled PNG and blur it (feather)
-                "[png_rgba]alphaextract,boxblur=12:12[mask_blurred];"
-                # alphamerge: put the blurred mask into the scaled video -> avatar with soft edges
-                "[vid_rgba][mask_blurred]alphamerge[avatar_soft];"
-                # lower music volume
-                "[3:a]volume=0.28[music];"
-                # overlay softened avatar onto the background (centered, slightly above bottom)
-                "[0:v][avatar_soft]overlay=x=(W-w)/2:y=H-h-150:format=yuv420[vout];"
-                # mix SadTalker audio (from input 1) with the lowered music
-                "[1:a][music]amix=inputs=2:duration=first:dropout_transition=2[aout]"
-            ),
-            "-map", "[vout]",
-            "-map", "[aout]",
-            "-c:v", "libx264",
-            "-crf", "18",
-            "-preset", "veryfast",
-            "-c:a", "aac",
-            "-shortest",
-            final_path
-        ]
-
-        print("[FFMPEG] Running composite (mask-based feathering)...")
-        # capture output to help debugging if ffmpeg fails
-        try:
-            proc = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-            print(proc.stdout)
-            print(proc.stderr)
-        except subprocess.CalledProcessError as e:
-            print("[FFMPEG-ERROR] ffmpeg failed:")
-            print(e.stdout if hasattr(e, "stdout") else "")
-            print(e.stderr if hasattr(e, "stderr") else "")
-            raise
-
-        print(f"[DEBUG] Background path in use: {background_path}")
-        print(f"[DEBUG] Music path in use: {music_path}")
-        print(f"[FFMPEG] Final video ready at {final_path}")
-        return jsonify({"success": True, "video_path": f"/video/{os.path.basename(final_path)}"})
-
-    except Exception as e:
-        logging.error(f"Video generation failed: {str(e)}\n{traceback.format_exc()}")
-        traceback.print_exc()
+        job = _submit_video_job(data)
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": f"Server busy: {e}"}), 429
+    except WorkerPoolError as e:
+        return jsonify({"success": False, "error": f"Workers unavailable: {e}"}), 503
+
+    job_manager.wait(job)
+    if job.status != DONE:
+        logging.error(f"Video generation failed: {job.error}")
+        if job.error_status and job.error_status < 500:
+            return jsonify({"success": False, "error": job.error}), job.error_status
         return jsonify({"success": False, "error": "Video generation failed"}), 500
+    return jsonify(_video_response(job.result))
+
+@app.route("/jobs/generate-video", methods=["POST"])
+def submit_video_job():
+    print("[ROUTE] /jobs/generate-video called")
+    data = request.get_json()
+    if not (data or {}).get("avatar"):
+        return jsonify({"success": False, "error": "No avatar filename provided"}), 400
+    try:
+        job = _submit_video_job(data)
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": f"Server busy: {e}"}), 429
+    except WorkerPoolError as e:
+        return jsonify({"success": False, "error": f"Workers unavailable: {e}"}), 503
+    return jsonify({"success": True, "job_id": job.id, "status_url": f"/jobs/{job.id}"}), 202
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    status = job.to_dict()
+    status["queue_position"] = job_manager.queue_position(job)
+    if job.status == DONE:
+        status["result_url"] = f"/jobs/{job.id}/result"
+        status.update(_video_response(job.result))
+    return jsonify({"success": True, **status})
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    if job.status == FAILED:
+        return jsonify({"success": False, "error": job.error}), job.error_status or 500
+    if job.status != DONE:
+        return jsonify({"success": False, "error": f"Job is {job.status}"}), 409
+    return send_file(job.result["video_path"], mimetype="video/mp4")
+
+@app.route("/jobs/background-removal/<job_id>")
+def background_removal_status(job_id):
+    """ Status of a background-removal job; once done, "paths" lists the avatar URLs it produced. """
+    job = bg_job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    status = job.to_dict()
+    status["queue_position"] = bg_job_manager.queue_position(job)
+    if job.status == FAILED:
+        return jsonify({"success": False, **status}), job.error_status or 500
+    if job.status == DONE:
+        status["paths"] = [f"/avatars/{os.path.basename(result['output'])}" for result in job.result["results"]]
+    return jsonify({"success": True, **status})
 
 @app.route("/select-scene-assets", methods=["POST"])
 def select_scene_assets():
+    """ Validate the chosen background and music; returns the names to pass to /generate-video. """
     try:
         data = request.get_json()
         selected_background = data.get("background")
@@ -333,31 +335,29 @@ def select_scene_assets():
         music_name = os.path.basename(selected_music)
 
         # Correct source paths (go up one directory from /server to /Vid_Gen/public)
-        bg_src = os.path.join(os.getcwd(), "..", "public", "backgrounds", bg_name)
-        music_src = os.path.join(os.getcwd(), "..", "public", "music", music_name)
-        bg_dest = os.path.join(OUTPUT_FOLDER, "background.png")
-        music_dest = os.path.join(OUTPUT_FOLDER, "music.mp3")
+        bg_src = os.path.join(PUBLIC_DIR, "backgrounds", bg_name)
+        music_src = os.path.join(PUBLIC_DIR, "music", music_name)
 
         # Debug confirmation
         print(f"[DEBUG] Background source: {bg_src}")
         print(f"[DEBUG] Music source: {music_src}")
-        print(f"[DEBUG] Destination folder: {OUTPUT_FOLDER}")
-
-        # Clear old files before copying
-        for f in [bg_dest, music_dest]:
-            if os.path.exists(f):
-                os.remove(f)
 
-        shutil.copy(bg_src, bg_dest)
-        shutil.copy(music_src, music_dest)
+        # Public assets are referenced in place; workers decode them once into the scene asset cache
+        if not os.path.isfile(bg_src) or not os.path.isfile(music_src):
+            return jsonify({"success": False, "error": "Background or music not found"}), 404
 
-        print(f"[ASSETS] Copied {bg_name} and {music_name} to output/")
-        return jsonify({"success": True, "message": "Scene assets copied successfully."})
+        print(f"[ASSETS] Selected {bg_name} and {music_name}")
+        return jsonify({"success": True, "background": bg_name, "music": music_name})
 
     except Exception as e:
         logging.error(f"Scene asset selection failed: {str(e)}\n{traceback.format_exc()}")
         return jsonify({"success": False, "error": "Scene asset selection failed"}), 500
 
+def _preloaded_avatar_paths(relative_path):
+    input_path = os.path.join(os.getcwd(), relative_path)
+    transparent_filename = f"transparent_{os.path.basename(relative_path)}"
+    return input_path, os.path.join(AVATAR_FOLDER, transparent_filename), f"/avatars/{transparent_filename}"
+
 @app.route("/process-preloaded-avatar", methods=["POST"])
 def process_preloaded_avatar():
     try:
@@ -366,34 +366,91 @@ def process_preloaded_avatar():
         if not relative_path:
             return jsonify({"success": False, "error": "No avatar path provided"}), 400
 
-        input_path = os.path.join(os.getcwd(), relative_path)
+        input_path, output_path, url = _preloaded_avatar_paths(relative_path)
         if not os.path.exists(input_path):
             return jsonify({"success": False, "error": "Avatar file not found"}), 404
 
-        filename = os.path.basename(relative_path)
-        transparent_filename = f"transparent_{filename}"
-        output_path = os.path.join(AVATAR_FOLDER, transparent_filename)
-        remove_avatar_background(input_path, output_path)
+        job = _remove_backgrounds([(input_path, output_path)])
+        if job is not None:
+            return _bg_job_response(job, [url])
 
-        return jsonify({"success": True, "path": f"/avatars/{transparent_filename}"})
+        return jsonify({"success": True, "path": url})
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": f"Server busy: {e}"}), 429
+    except WorkerPoolError as e:
+        return jsonify({"success": False, "error": f"Workers unavailable: {e}"}), 503
     except Exception as e:
         logging.error(f"Error processing preloaded avatar: {str(e)}\n{traceback.format_exc()}")
         return jsonify({"success": False, "error": "Failed to process preloaded avatar"}), 500
 
+@app.route("/process-preloaded-avatars", methods=["POST"])
+def process_preloaded_avatars():
+    """ Batch form of /process-preloaded-avatar: {"paths": [...]} -> {"paths": [...]} in the same order. """
+    try:
+        data = request.get_json() or {}
+        relative_paths = data.get("paths") or []
+        if not relative_paths:
+            return jsonify({"success": False, "error": "No avatar paths provided"}), 400
+
+        resolved = [_preloaded_avatar_paths(p) for p in relative_paths]
+        missing = [p for p, (input_path, _, _) in zip(relative_paths, resolved) if not os.path.exists(input_path)]
+        if missing:
+            return jsonify({"success": False, "error": f"Avatar file not found: {', '.join(missing)}"}), 404
+
+        job = _remove_backgrounds([(input_path, output_path) for input_path, output_path, _ in resolved])
+        if job is not None:
+            return _bg_job_response(job, [url for _, _, url in resolved])
+
+        return jsonify({"success": True, "paths": [url for _, _, url in resolved]})
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": f"Server busy: {e}"}), 429
+    except WorkerPoolError as e:
+        return jsonify({"success": False, "error": f"Workers unavailable: {e}"}), 503
+    except Exception as e:
+        logging.error(f"Error processing preloaded avatars: {str(e)}\n{traceback.format_exc()}")
+        return jsonify({"success": False, "error": "Failed to process preloaded avatars"}), 500
+
 @app.route("/video/<filename>")
 def serve_video(filename):
     print(f"[ROUTE] Serving video: {filename}")
-    return send_from_directory("output", filename, mimetype="video/mp4")
-
-@app.route("/download-video")
-def download_video():
+    path = artifact_store.path(filename)
+    if path is None:
+        return jsonify({"success": False, "error": "Video not found"}), 404
+    return send_file(path, mimetype="video/mp4")
+
+@app.route("/download-video/<filename>")
+def download_video(filename):
+    path = artifact_store.path(filename)
+    if path is None:
+        return jsonify({"success": False, "error": "Video not found"}), 404
     return send_file(
-        os.path.join("output", "final_video.mp4"),   # FIXED: use final_video.mp4 directly
+        path,
         mimetype="video/mp4",
         as_attachment=True,
         download_name="avatar_scene.mp4"
     )
 
+@app.route("/healthz")
+def healthz():
+    """ Liveness: the process is up and serving requests. """
+    return jsonify({"success": True, "status": "ok"})
+
+@app.route("/readyz")
+def readyz():
+    """ Readiness: every model is loaded and has run once; 503 until then, with per-model status and timings. """
+    sadtalker = job_manager.readiness()
+    bg_removal = bg_job_manager.readiness()
+    tts_ready = warmup_status["tts"]["status"] == "ok" or not WARMUP_ON_START
+    ready = tts_ready and sadtalker["ready"] and bg_removal["ready"]
+    body = {"success": ready, "ready": ready, "warmup_on_start": WARMUP_ON_START,
+            "tts": warmup_status["tts"], "sadtalker": sadtalker, "background_removal": bg_removal}
+    return jsonify(body), 200 if ready else 503
+
+# === Warm up as soon as the app is set up, whether run directly, by `flask run` or a WSGI host ===
+# (spawned job workers re-import a directly run app.py as __mp_main__; they must not start pools of their own)
+if WARMUP_ON_START and multiprocessing.parent_process() is None:
+    start_warmup()
+
 # === Run Flask Server ===
 if __name__ == "__main__":
     app.run(port=5001, debug=False, use_reloader=False)
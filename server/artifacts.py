@@ -0,0 +1,124 @@
+"""
+Content-addressed artifact store with per-job scratch directories.
+
+Every file the server hands out (TTS audio, scene assets, rendered videos) is
+stored once under the SHA-256 of its bytes, so concurrent requests never write
+to the same path and identical outputs are shared. Jobs do their intermediate
+work in private directories under work/. Both are removed once they have not
+been touched for ttl seconds.
+"""
+import hashlib, os, re, shutil, tempfile, threading, time, uuid
+
+ARTIFACT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_SECONDS", 24 * 3600))
+ARTIFACT_CLEANUP_INTERVAL = int(os.environ.get("ARTIFACT_CLEANUP_INTERVAL", 600))
+
+_NAME_RE = re.compile(r"^[0-9a-f]{32}(\.[A-Za-z0-9]{1,8})?$")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactStore():
+    def __init__(self, root, ttl=ARTIFACT_TTL_SECONDS, cleanup_interval=ARTIFACT_CLEANUP_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self.work_root = os.path.join(self.root, "work")
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.work_root, exist_ok=True)
+
+    @staticmethod
+    def is_name(name):
+        return bool(name) and bool(_NAME_RE.match(name))
+
+    def _blob_path(self, name):
+        return os.path.join(self.blob_dir, name)
+
+    def put_file(self, src_path, ext=None, move=False):
+        """ Store src_path under its content hash and return the artifact name. """
+        if ext is None:
+            ext = os.path.splitext(src_path)[1]
+        name = file_digest(src_path)[:32] + ext.lower()
+        dest = self._blob_path(name)
+        if os.path.exists(dest):
+            os.utime(dest)
+            if move:
+                os.remove(src_path)
+        else:
+            # write next to the destination and rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+            os.close(fd)
+            if move:
+                shutil.move(src_path, tmp_path)
+            else:
+                shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dest)
+        self.maybe_cleanup()
+        return name
+
+    def put_bytes(self, data, ext=""):
+        name = hashlib.sha256(data).hexdigest()[:32] + ext.lower()
+        dest = self._blob_path(name)
+        if os.path.exists(dest):
+            os.utime(dest)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, dest)
+        self.maybe_cleanup()
+        return name
+
+    def path(self, name):
+        """ Absolute path of an artifact, or None if the name is invalid or expired. """
+        if not self.is_name(name):
+            return None
+        path = self._blob_path(name)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def new_work_dir(self, prefix="job"):
+        """ Private scratch directory for one request or job. """
+        path = os.path.join(self.work_root, f"{prefix}_{uuid.uuid4().hex}")
+        os.makedirs(path)
+        return path
+
+    def maybe_cleanup(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = now
+        self.cleanup()
+
+    def cleanup(self):
+        """ Delete blobs and work directories untouched for longer than ttl. """
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.blob_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        for entry in os.scandir(self.work_root):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            print(f"[ARTIFACTS] Removed {removed} expired artifact(s)")
+        return removed
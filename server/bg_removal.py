@@ -0,0 +1,120 @@
+"""
+Background removal with warm rembg sessions and a content-addressed result cache.
+
+Each process keeps one rembg session per model, so the ONNX model is loaded once
+instead of on every call. Transparent PNGs are cached on disk under the SHA-256
+of the input bytes (plus the model name): the same picture uploaded under another
+name, a preloaded avatar picked again or a duplicate in one batch is never run
+through the model twice.
+"""
+import os, shutil, tempfile, threading
+
+from artifacts import file_digest
+from lazy import lazy_import
+
+# rembg pulls in onnxruntime; both load on the first removal, not at import
+rembg = lazy_import("rembg")
+Image = lazy_import("PIL.Image")
+
+BG_REMOVAL_MODEL = os.environ.get("BG_REMOVAL_MODEL", "u2net")
+BG_REMOVAL_CACHE_DIR = os.environ.get("BG_REMOVAL_CACHE_DIR", os.path.join(os.getcwd(), "output", "cache", "bg_removal"))
+BG_REMOVAL_CACHE_MAX_BYTES = int(os.environ.get("BG_REMOVAL_CACHE_MAX_BYTES", 1024 ** 3))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(model=BG_REMOVAL_MODEL):
+    """ The warm rembg session of this process for model. """
+    with _sessions_lock:
+        if model not in _sessions:
+            print(f"[BG-REMOVE] Loading rembg session {model} in process {os.getpid()}")
+            _sessions[model] = rembg.new_session(model)
+        return _sessions[model]
+
+
+def _publish(src_path, dest_path):
+    # concurrent jobs may ask for the same avatar; readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix=".part")
+    os.close(fd)
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+class BackgroundRemover():
+    def __init__(self, cache_dir=BG_REMOVAL_CACHE_DIR, model=BG_REMOVAL_MODEL, max_bytes=BG_REMOVAL_CACHE_MAX_BYTES):
+        self.model = model
+        self.cache_dir = os.path.join(os.path.abspath(cache_dir), model)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:40] + ".png")
+
+    def restore(self, input_path, output_path, digest=None):
+        """ Write the cached result for input_path to output_path; False on a miss. """
+        cached = self._cache_path(digest or file_digest(input_path))
+        try:
+            os.utime(cached)
+        except FileNotFoundError:
+            return False
+        _publish(cached, output_path)
+        return True
+
+    def remove_batch(self, items):
+        """
+        Remove the background of every (input_path, output_path) pair with one warm session.
+        Returns one {"output", "cached"} dict per pair, in order.
+        """
+        results = []
+        done = {}
+        for input_path, output_path in items:
+            digest = file_digest(input_path)
+            cached = digest in done or self.restore(input_path, output_path, digest)
+            if digest in done:
+                _publish(done[digest], output_path)
+            elif not cached:
+                self._remove(input_path, digest)
+                _publish(self._cache_path(digest), output_path)
+            done[digest] = self._cache_path(digest)
+            print(f"[BG-REMOVE] {input_path} -> {output_path} ({'cached' if cached else self.model})")
+            results.append({"output": output_path, "cached": bool(cached)})
+        self._evict()
+        return results
+
+    def remove(self, input_path, output_path):
+        return self.remove_batch([(input_path, output_path)])[0]
+
+    def _remove(self, input_path, digest):
+        input_image = Image.open(input_path).convert("RGBA")
+        output_image = rembg.remove(input_image, session=get_session(self.model))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        os.close(fd)
+        output_image.save(tmp_path, format="PNG")
+        os.replace(tmp_path, self._cache_path(digest))
+
+    def warmup(self):
+        """ Load the session and run one tiny image through it. """
+        rembg.remove(Image.new("RGBA", (64, 64)), session=get_session(self.model))
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith(".png"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
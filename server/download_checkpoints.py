@@ -1,22 +1,115 @@
-from huggingface_hub import hf_hub_download
-import shutil
-import os
-
-# Where to put the files
-target_dir = os.path.join(os.getcwd(), "SadTalker", "checkpoints")
-os.makedirs(target_dir, exist_ok=True)
-
-files = [
-    "checkpoints/mapping_00109.pth.tar",
-    "checkpoints/mapping_00229.pth.tar",
-    "checkpoints/facevid2vid_00189.pth.tar"
-]
-
-for fname in files:
-    print(f"Downloading {fname}...")
-    path = hf_hub_download(
-        repo_id="vinthony/SadTalker",
-        filename=fname
-    )
-    shutil.copy(path, os.path.join(target_dir, os.path.basename(fname)))
-    print(f"Copied {os.path.basename(fname)} to {target_dir}")
+"""
+Fetch every model weight into the local weight registry and record its checksum.
+
+This is the only part of the server that downloads anything; run it at build time,
+where the network is available, then ship the weights directory (SADTALKER_WEIGHTS_DIR)
+with its weights.sha256 manifest. Workers resolve and verify weights from there only.
+
+python download_checkpoints.py            # download what is missing, rewrite the manifest
+python download_checkpoints.py --manifest # only hash the files already present
+python download_checkpoints.py --check    # offline: report missing / corrupt weights, exit 1 on any
+"""
+import os, sys, shutil, tempfile, urllib.request
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "SadTalker", "src"))
+
+from utils.weights import (WEIGHTS_DIR, MANIFEST_NAME, AUX_MODELS, FACE_MODELS, ENHANCER_MODELS, WEIGHT_EXTENSIONS,
+                           WeightRegistry, sha256_file, write_manifest, sadtalker_weights)
+from utils.init_path import init_path, SAFETENSOR_NAME
+
+_RELEASE = "https://github.com/OpenTalker/SadTalker/releases/download/v0.0.2-rc/"
+_LEGACY_RELEASE = "https://github.com/Winfredy/SadTalker/releases/download/v0.0.2/"
+
+# SadTalker checkpoints: local file name (as init_path resolves it) -> source url
+SADTALKER_SOURCES = {
+    SAFETENSOR_NAME % 256: _RELEASE + SAFETENSOR_NAME % 256,
+    SAFETENSOR_NAME % 512: _RELEASE + SAFETENSOR_NAME % 512,
+    "mapping_00109-model.pth.tar": _RELEASE + "mapping_00109-model.pth.tar",
+    "mapping_00229-model.pth.tar": _RELEASE + "mapping_00229-model.pth.tar",
+    "audio2pose.pth": _LEGACY_RELEASE + "audio2pose_00140-model.pth",
+    "audio2exp.pth": _LEGACY_RELEASE + "audio2exp_00300-model.pth",
+    "facevid2vid_00189-model.pth.tar": _LEGACY_RELEASE + "facevid2vid_00189-model.pth.tar",
+    "epoch_20.pth": _LEGACY_RELEASE + "epoch_20.pth",
+}
+
+
+def required_weights(target_dir, sizes, enhancer):
+    """ {file name: (path, source url)} of everything the workers load, as the runtime resolves it. """
+    registry = WeightRegistry(target_dir, verify=True, search=[])
+    weights = {}
+    for size in sizes:
+        for preprocess in ("crop", "full"):
+            for path in sadtalker_weights(init_path(target_dir, None, size, False, preprocess)).values():
+                weights[os.path.basename(path)] = (path, SADTALKER_SOURCES.get(os.path.basename(path)))
+    names = FACE_MODELS + (sorted({name for models in ENHANCER_MODELS.values() for name in models}) if enhancer else [])
+    for name in names:
+        weights[name] = (registry.path(name), AUX_MODELS[name][1])
+    return weights
+
+
+def fetch(url, dest):
+    print(f"Downloading {os.path.basename(dest)} from {url}...")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".part")
+    try:
+        with urllib.request.urlopen(url) as response, os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(response, f)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def download(target_dir, sizes, enhancer):
+    # init_path switches to the per-size safetensors checkpoint once it is installed, so fetch
+    # those first; everything else is then whatever the runtime resolves from this directory
+    for size in sizes:
+        dest = os.path.join(target_dir, SAFETENSOR_NAME % size)
+        if not os.path.exists(dest):
+            fetch(SADTALKER_SOURCES[SAFETENSOR_NAME % size], dest)
+    weights = required_weights(target_dir, sizes, enhancer)
+    unknown = sorted(name for name, (path, url) in weights.items() if url is None and not os.path.exists(path))
+    if unknown:
+        sys.exit("no download source for required weights: %s" % ", ".join(unknown))
+    for name, (path, url) in sorted(weights.items()):
+        if not os.path.exists(path):
+            fetch(url, path)
+
+
+def build_manifest(target_dir):
+    entries = {}
+    for dirpath, _, files in os.walk(target_dir):
+        for name in files:
+            if name.endswith(WEIGHT_EXTENSIONS):
+                path = os.path.join(dirpath, name)
+                entries[os.path.relpath(path, target_dir)] = sha256_file(path)
+                print(f"  {entries[os.path.relpath(path, target_dir)]}  {os.path.relpath(path, target_dir)}")
+    write_manifest(os.path.join(target_dir, MANIFEST_NAME), entries)
+    print(f"Wrote {len(entries)} checksums to {os.path.join(target_dir, MANIFEST_NAME)}")
+
+
+def check(target_dir, sizes, enhancer):
+    registry = WeightRegistry(target_dir, verify=True, search=[])
+    report = registry.check({name: path for name, (path, url) in required_weights(target_dir, sizes, enhancer).items()})
+    for label, entry in sorted(report.items()):
+        print(f"  {label:<40} {entry['status']:<18} {entry['path']}")
+    return all(entry["status"] == "ok" for entry in report.values())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--dir", default=WEIGHTS_DIR, help="weights directory (SADTALKER_WEIGHTS_DIR)")
+    parser.add_argument("--manifest", action="store_true", help="do not download, only rewrite the manifest")
+    parser.add_argument("--check", action="store_true", help="verify the weights offline and exit")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512], help="SadTalker sizes to download / check")
+    parser.add_argument("--no-enhancer", action="store_true", help="skip the face enhancer weights")
+    args = parser.parse_args()
+
+    target_dir = os.path.abspath(args.dir)
+    os.makedirs(target_dir, exist_ok=True)
+    if args.check:
+        sys.exit(0 if check(target_dir, args.sizes, not args.no_enhancer) else 1)
+    if not args.manifest:
+        download(target_dir, args.sizes, not args.no_enhancer)
+    build_manifest(target_dir)
@@ -0,0 +1,270 @@
+"""
+Asynchronous job subsystem for long-running generations.
+
+Jobs are submitted from the Flask request thread and executed by a pool of
+worker processes, so HTTP threads only ever enqueue work and poll status.
+Workers report stage progress and timings back through a multiprocessing
+queue that a listener thread folds into the in-memory job table.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+import os, threading, time, traceback, uuid
+
+# === Configuration (environment overridable) ===
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", max(1, (os.cpu_count() or 2) // 4)))
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", 8))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFullError(Exception):
+    """ Raised by JobManager.submit when admission control rejects a job. """
+
+
+class WorkerPoolError(Exception):
+    """ Raised by JobManager.submit when the worker pool is broken and could not be rebuilt. """
+
+
+# === Worker process side ===
+_events = None
+
+
+def _init_worker(events, warmup=None):
+    global _events
+    _events = events
+    if warmup:
+        import pipeline
+        _events.put((None, "warmup", getattr(pipeline, warmup)()))
+
+
+def _ping():
+    return os.getpid()
+
+
+def _run_job(job_id, task, kwargs):
+    import pipeline
+
+    def progress(stage, fraction):
+        _events.put((job_id, "progress", {"stage": stage, "fraction": fraction, "time": time.time()}))
+
+    _events.put((job_id, RUNNING, {"pid": os.getpid(), "time": time.time()}))
+    fn = getattr(pipeline, task)
+    try:
+        return fn(progress=progress, **kwargs)
+    except pipeline.PipelineError as e:
+        return {"error": str(e), "status": e.status}
+
+
+# === Server side ===
+class Job():
+    def __init__(self, job_id, task, kwargs):
+        self.id = job_id
+        self.task = task
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.stage = None
+        self.stage_progress = 0.0
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.done_event = threading.Event()
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "stage_progress": self.stage_progress,
+            "timings": self.timings,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.started_at:
+            data["queue_seconds"] = round(self.started_at - self.submitted_at, 3)
+        if self.finished_at and self.started_at:
+            data["run_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class JobManager():
+    """
+    Bounded job queue in front of a ProcessPoolExecutor.
+
+    At most max_workers jobs run at once and at most max_queue more may wait;
+    anything beyond that is rejected with QueueFullError so callers can answer 429
+    instead of letting requests pile up. With warmup (the name of a pipeline function),
+    each worker loads and exercises its models as it starts and reports the result
+    to readiness().
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_queue=JOB_MAX_QUEUE, retention=JOB_RETENTION_SECONDS, warmup=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retention = retention
+        self.warmup = warmup
+        self.warmup_reports = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._executor = None
+        self._events = None
+
+    def _ensure_started(self):
+        with self._pool_lock:
+            if self._executor is not None:
+                return self._executor
+            # spawn: torch and onnxruntime are not fork-safe once initialised in the parent
+            ctx = mp.get_context("spawn")
+            self._events = ctx.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self._events, self.warmup)
+            )
+            threading.Thread(target=self._listen, args=(self._events,), name="job-events", daemon=True).start()
+            print(f"[JOBS] Worker pool started with {self.max_workers} process(es), queue depth {self.max_queue}")
+            return self._executor
+
+    def start(self):
+        """ Spawn every worker now (warming its models if enabled) rather than on the first submit. """
+        executor = self._ensure_started()
+        # each submit while no worker is idle spawns another process
+        try:
+            for _ in range(self.max_workers):
+                executor.submit(_ping)
+        except BrokenProcessPool:
+            pass  # the next submit rebuilds the pool
+
+    def _restart(self, broken):
+        """ Replace a broken pool (a worker died) with a fresh one, warmed like the first. """
+        with self._pool_lock:
+            if self._executor is not broken:
+                return  # another thread already replaced it
+            print("[JOBS] Worker pool is broken, starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            # stop the old listener; reports from the dead workers no longer apply
+            self._events.put((None, "stop", None))
+            self._executor = None
+            with self._lock:
+                self.warmup_reports.clear()
+        self.start()
+
+    def readiness(self):
+        with self._lock:
+            reports = dict(self.warmup_reports)
+        warmed = sum(1 for r in reports.values() if r.get("ok"))
+        return {
+            "workers": self.max_workers,
+            "warmed": warmed,
+            "ready": (not self.warmup) or warmed > 0,
+            "reports": reports,
+        }
+
+    def _listen(self, events):
+        while True:
+            job_id, kind, payload = events.get()
+            if kind == "stop":
+                return
+            with self._lock:
+                if kind == "warmup":
+                    self.warmup_reports[payload["pid"]] = payload
+                    continue
+                job = self._jobs.get(job_id)
+                # events can trail the done callback; a finished job is final
+                if job is None or job.status in (DONE, FAILED):
+                    continue
+                if kind == RUNNING:
+                    job.status = RUNNING
+                    job.started_at = payload["time"]
+                elif kind == "progress":
+                    job.stage = payload["stage"]
+                    job.stage_progress = payload["fraction"]
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    def submit(self, task, **kwargs):
+        """ Queue pipeline.<task>(**kwargs) and return its Job. """
+        self._prune()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+            if pending >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"{pending} jobs pending, limit is {self.max_workers + self.max_queue}")
+            job = Job(uuid.uuid4().hex, task, kwargs)
+            self._jobs[job.id] = job
+        for attempt in range(2):
+            executor = self._ensure_started()
+            try:
+                job.future = executor.submit(_run_job, job.id, task, kwargs)
+                break
+            except BrokenProcessPool:
+                self._restart(executor)
+        else:
+            with self._lock:
+                del self._jobs[job.id]
+            raise WorkerPoolError("Worker pool is unavailable")
+        job.future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        print(f"[JOBS] Queued {task} job {job.id}")
+        return job
+
+    def _finish(self, job, future):
+        with self._lock:
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.finished_at
+            try:
+                result = future.result()
+            except Exception as e:
+                job.status = FAILED
+                job.error = str(e) or e.__class__.__name__
+                job.error_status = 500
+                print(f"[JOBS] Job {job.id} failed:\n{''.join(traceback.format_exception(type(e), e, e.__traceback__))}")
+            else:
+                if "error" in result:
+                    job.status = FAILED
+                    job.error = result["error"]
+                    job.error_status = result.get("status", 500)
+                else:
+                    job.status = DONE
+                    job.timings.update(result.get("timings", {}))
+                job.result = result
+            job.stage_progress = 1.0 if job.status == DONE else job.stage_progress
+        job.done_event.set()
+        print(f"[JOBS] Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job):
+        with self._lock:
+            queued = sorted((j for j in self._jobs.values() if j.status == QUEUED), key=lambda j: j.submitted_at)
+        return queued.index(job) if job in queued else None
+
+    def wait(self, job, timeout=None):
+        job.done_event.wait(timeout)
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        with self._pool_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
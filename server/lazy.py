@@ -0,0 +1,36 @@
+"""
+Thin facades for heavy optional subsystems.
+
+`rembg = lazy_import("rembg")` costs nothing at import time; the real module is
+imported on first attribute access. Keeps `import app` fast for processes that
+never touch the models (see scripts/check_import_time.py).
+"""
+import importlib, threading
+
+
+class LazyModule():
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,252 @@
+"""
+Video generation pipeline shared by the Flask routes and the job worker processes.
+
+Everything in here must be importable without Flask so that worker processes
+(spawned by jobs.JobManager) can run a full generation on their own.
+"""
+import os, sys, time, shutil
+
+from artifacts import ArtifactStore
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SADTALKER_DIR = os.path.join(BASE_DIR, "SadTalker", "src")
+# === Setup Python paths ===
+if SADTALKER_DIR not in sys.path:
+    sys.path.append(SADTALKER_DIR)
+    sys.path.append(os.path.join(SADTALKER_DIR, "utils"))
+
+from utils.init_path import init_path
+
+# Load SadTalker paths once
+sadtalker_paths = init_path()
+
+# Upper bound for the warm SadTalker model pool (bytes); unset means keep every variant loaded
+SADTALKER_POOL_MAX_BYTES = os.environ.get("SADTALKER_POOL_MAX_BYTES")
+SADTALKER_POOL_MAX_BYTES = int(SADTALKER_POOL_MAX_BYTES) if SADTALKER_POOL_MAX_BYTES else None
+
+# Keep per-render debug dumps (e.g. the generated 3DMM coefficients as .npy); off in production
+SADTALKER_DEBUG_ARTIFACTS = os.environ.get("SADTALKER_DEBUG_ARTIFACTS", "0") == "1"
+
+# Crop / landmark / 3DMM results per avatar, shared by every worker process
+PREPROCESS_CACHE_DIR = os.environ.get("PREPROCESS_CACHE_DIR", os.path.join(os.getcwd(), "output", "cache", "preprocess"))
+
+# Models warmed when a worker process starts: "size/preprocess" pairs, plus the optional face enhancer
+SADTALKER_WARMUP_VARIANTS = [(int(v.split("/")[0]), v.split("/")[1]) for v in
+                             os.environ.get("SADTALKER_WARMUP_VARIANTS", "256/crop").split(",") if v.strip()]
+SADTALKER_WARMUP_ENHANCER = os.environ.get("SADTALKER_WARMUP_ENHANCER", "0") == "1"
+
+# Decoded backgrounds, feathered masks (in memory, bounded) and music PCM (on disk, shared)
+SCENE_CACHE_DIR = os.environ.get("SCENE_CACHE_DIR", os.path.join(os.getcwd(), "output", "cache", "scene"))
+SCENE_CACHE_MAX_BYTES = int(os.environ.get("SCENE_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+
+# One SadTalker per process, created on first use
+_sadtalker = None
+_scene_assets = None
+
+
+def get_sadtalker():
+    global _sadtalker
+    if _sadtalker is None:
+        print("[SADTALKER] Initializing SadTalker...")
+        from gradio_demo import SadTalker
+        _sadtalker = SadTalker(
+            checkpoint_path=sadtalker_paths["checkpoints_dir"],
+            config_path=sadtalker_paths["config_dir"],
+            lazy_load=False,
+            max_pool_bytes=SADTALKER_POOL_MAX_BYTES,
+            preprocess_cache_dir=PREPROCESS_CACHE_DIR
+        )
+        print("[SADTALKER] Initialized successfully")
+    return _sadtalker
+
+
+def get_scene_assets():
+    global _scene_assets
+    if _scene_assets is None:
+        from utils.compositing import SceneAssetCache
+        _scene_assets = SceneAssetCache(max_bytes=SCENE_CACHE_MAX_BYTES, pcm_dir=os.path.join(SCENE_CACHE_DIR, "pcm"))
+    return _scene_assets
+
+
+def warmup(progress=None):
+    """
+    Load and exercise every SadTalker model in this process. Never raises: failures are
+    reported per model so a broken checkpoint shows up in /readyz instead of killing the worker.
+    """
+    report = {"pid": os.getpid(), "ok": False, "variants": {}}
+    start = time.time()
+    try:
+        sadtalker = get_sadtalker()
+        report["init_seconds"] = round(time.time() - start, 3)
+        report["variants"] = sadtalker.warmup(SADTALKER_WARMUP_VARIANTS, dummy_inference=True,
+                                              enhancer=SADTALKER_WARMUP_ENHANCER)
+        report["ok"] = all(m["status"] == "ok" for v in report["variants"].values() for m in v["models"].values())
+    except Exception as e:
+        print(f"[WARMUP] SadTalker warmup failed: {e}")
+        report["error"] = str(e)
+        if hasattr(e, "report"):
+            # MissingWeightsError: the per-file status of every weight that was checked
+            report["weights"] = e.report
+    report["seconds"] = round(time.time() - start, 3)
+    print(f"[WARMUP] Worker {report['pid']} warm in {report['seconds']}s (ok={report['ok']})")
+    return report
+
+
+class PipelineError(Exception):
+    """ A user-facing failure (missing avatar, missing audio, ...) with an HTTP status. """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# === Helper to remove avatar background ===
+_bg_remover = None
+
+
+def get_background_remover():
+    global _bg_remover
+    if _bg_remover is None:
+        from bg_removal import BackgroundRemover
+        _bg_remover = BackgroundRemover()
+    return _bg_remover
+
+
+def remove_avatar_background(input_path, output_path):
+    print(f"[BG-REMOVE] Removing background from {input_path}")
+    try:
+        get_background_remover().remove(input_path, output_path)
+        print(f"[BG-REMOVE] Saved processed image to {output_path}")
+    except Exception as e:
+        print(f"[ERROR] Background removal failed: {e}")
+        raise
+
+
+def remove_backgrounds(items, progress=None):
+    """ Job task: remove the background of every [input_path, output_path] pair with this worker's session. """
+    progress = progress or _noop_progress
+    start = time.time()
+    progress("background_removal", 0.0)
+    for input_path, _ in items:
+        if not os.path.exists(input_path):
+            raise PipelineError(f"Avatar file not found: {os.path.basename(input_path)}", 404)
+    results = get_background_remover().remove_batch([tuple(item) for item in items])
+    progress("background_removal", 1.0)
+    return {"results": results, "timings": {"background_removal": round(time.time() - start, 3)}}
+
+
+def warmup_background_removal(progress=None):
+    """ Worker warmup for the background-removal pool; never raises, see warmup(). """
+    from bg_removal import BG_REMOVAL_MODEL
+    report = {"pid": os.getpid(), "ok": False, "models": {}}
+    start = time.time()
+    try:
+        get_background_remover().warmup()
+        report["ok"] = True
+        report["models"][f"rembg/{BG_REMOVAL_MODEL}"] = {"status": "ok", "seconds": round(time.time() - start, 3)}
+    except Exception as e:
+        print(f"[WARMUP] rembg warmup failed: {e}")
+        report["models"][f"rembg/{BG_REMOVAL_MODEL}"] = {"status": "error", "seconds": round(time.time() - start, 3), "error": str(e)}
+    report["seconds"] = round(time.time() - start, 3)
+    return report
+
+
+def _noop_progress(stage, fraction):
+    pass
+
+
+def _discard_work_dir(work_dir):
+    # with debug artifacts on, leave the work dir for inspection; the artifact store TTL removes it later
+    if not SADTALKER_DEBUG_ARTIFACTS:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def generate_video(avatar_filename, audio_path, avatar_folder, artifact_root, work_dir,
+                   background_path=None, music_path=None, progress=None):
+    """
+    Run the full avatar -> SadTalker -> composite pipeline inside work_dir.
+
+    progress(stage, fraction) is called as each stage starts and finishes.
+    The result is stored in the artifact store at artifact_root and returned as
+    {"video": <artifact name>, "video_path": <absolute path>, "composited": bool, "timings": {stage: seconds}}.
+    """
+    progress = progress or _noop_progress
+    timings = {}
+
+    def run_stage(stage, fn, *args, **kwargs):
+        progress(stage, 0.0)
+        start = time.time()
+        result = fn(*args, **kwargs)
+        timings[stage] = round(time.time() - start, 3)
+        progress(stage, 1.0)
+        return result
+
+    if not avatar_filename:
+        raise PipelineError("No avatar filename provided", 400)
+
+    avatar_rel = avatar_filename.replace("/avatars/", "")
+
+    uploaded_avatar_path = os.path.join(avatar_folder, avatar_rel)
+    preloaded_avatar_path = os.path.join(os.path.dirname(BASE_DIR), "public", "avatars", avatar_rel)
+
+    if os.path.exists(uploaded_avatar_path):
+        source_path = uploaded_avatar_path
+        print(f"[DEBUG] Using uploaded avatar: {source_path}")
+    elif os.path.exists(preloaded_avatar_path):
+        source_path = preloaded_avatar_path
+        print(f"[DEBUG] Using preloaded avatar: {source_path}")
+    else:
+        raise PipelineError(f"Avatar not found: {avatar_rel}", 404)
+
+    # ensure a transparent PNG exists (created earlier by remove_avatar_background)
+    transparent_filename = f"transparent_{avatar_rel}"
+    transparent_path = os.path.join(avatar_folder, transparent_filename)
+    if not os.path.exists(transparent_path):
+        print(f"[BG-REMOVE] Generating transparent avatar: {transparent_filename}")
+        run_stage("background_removal", remove_avatar_background, source_path, transparent_path)
+    else:
+        print(f"[BG-REMOVE] Transparent avatar already exists: {transparent_filename}")
+
+    avatar_full = transparent_path
+    print(f"[DEBUG] Avatar to use for SadTalker: {avatar_full}")
+
+    # Ensure TTS audio exists
+    if not audio_path or not os.path.exists(audio_path):
+        raise PipelineError("Audio file not found", 404)
+
+    sadtalker = run_stage("load_models", get_sadtalker)
+
+    # With a background and music the avatar is composited while it is rendered,
+    # so the scene video comes out of a single encode
+    scene = None
+    if background_path and music_path and os.path.exists(background_path) and os.path.exists(music_path):
+        from utils.compositing import SceneCompositor
+        print(f"[DEBUG] Background path in use: {background_path}")
+        print(f"[DEBUG] Music path in use: {music_path}")
+        scene = run_stage("scene", SceneCompositor, background_path, avatar_full, music_path, assets=get_scene_assets())
+    else:
+        print("[WARN] Missing background or music, returning raw SadTalker video")
+
+    # Run SadTalker -> produces a video in <work_dir>/<uuid>/transparent_<name>##<audio>.mp4
+    print("[SADTALKER] Running test()...")
+    video_path = run_stage(
+        "sadtalker", sadtalker.test,
+        source_image=avatar_full,
+        driven_audio=audio_path,
+        preprocess='crop',
+        still_mode=False,
+        use_enhancer=False,
+        batch_size=1,
+        size=256,
+        result_dir=work_dir,
+        debug_artifacts=SADTALKER_DEBUG_ARTIFACTS,
+        scene=scene
+    )
+    video_path = os.path.abspath(video_path)
+    print(f"[SADTALKER] Video generated at {video_path}")
+
+    store = ArtifactStore(artifact_root)
+    name = store.put_file(video_path, move=True)
+    _discard_work_dir(work_dir)
+    return {"video": name, "video_path": store.path(name), "composited": scene is not None, "timings": timings}
@@ -0,0 +1,68 @@
+"""Startup import-time budget for the Flask app.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and fails (exit 1)
+if the import takes longer than the budget or drags in any of the heavy model
+subsystems, which must stay behind lazy facades (see lazy.py).
+
+python scripts/check_import_time.py --budget-ms 1500 --repeat 3
+"""
+import os
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# top-level packages that must not be imported by `import app`
+FORBIDDEN = ['torch', 'torchvision', 'rembg', 'onnxruntime', 'PIL', 'TTS', 'cv2', 'numpy',
+             'scipy', 'librosa', 'pydub', 'gfpgan', 'facexlib', 'gradio_demo', 'safetensors']
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def measure(module):
+    """ Return (total import microseconds, {top-level package: cumulative us}) for one cold import. """
+    env = dict(os.environ, WARMUP_ON_START='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                          cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import %s failed:\n%s' % (module, proc.stderr[-4000:]))
+
+    total, packages = 0, {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if not m:
+            continue
+        cumulative, name = int(m.group(2)), m.group(4)
+        top = name.split('.')[0]
+        packages[top] = max(packages.get(top, 0), cumulative)
+        if name == module:
+            total = cumulative
+    return total, packages
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 1500)))
+    parser.add_argument('--repeat', type=int, default=3, help='best of N cold imports')
+    parser.add_argument('--top', type=int, default=10, help='slowest packages to print')
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    total, packages = min(runs, key=lambda run: run[0])
+
+    print(f'import {args.module}: {total / 1e3:.1f} ms (best of {args.repeat}, budget {args.budget_ms:.0f} ms)')
+    for name, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'  {us / 1e3:8.1f} ms  {name}')
+
+    failures = []
+    heavy = sorted(set(FORBIDDEN) & set(packages))
+    if heavy:
+        failures.append('heavy modules imported eagerly: ' + ', '.join(heavy))
+    if total / 1e3 > args.budget_ms:
+        failures.append(f'{total / 1e3:.1f} ms exceeds the {args.budget_ms:.0f} ms budget')
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
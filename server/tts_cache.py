@@ -0,0 +1,102 @@
+"""
+Content-addressed cache of synthesized speech.
+
+Entries are keyed by the normalized script text, the TTS model name and the
+voice parameters, and persist as <key>.wav under the cache root so they survive
+restarts. Once the cache grows past max_bytes the least recently used entries
+are removed.
+"""
+import hashlib, json, os, re, shutil, tempfile, threading, unicodedata
+
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """ Collapse the differences that do not change the synthesized audio (unicode forms, whitespace). """
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class TTSCache():
+    def __init__(self, root, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # sentence-level lookups by TTSEngine, counted apart from whole-script requests
+        self.sentence_hits = 0
+        self.sentence_misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(text, model_name, **voice):
+        payload = json.dumps([normalize_text(text), model_name, voice], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:40]
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".wav")
+
+    def get(self, key, sentence=False):
+        """ Path of the cached wav for key (marking it recently used), or None. """
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            path = None
+        with self._lock:
+            if sentence:
+                self.sentence_hits += path is not None
+                self.sentence_misses += path is None
+            else:
+                self.hits += path is not None
+                self.misses += path is None
+        return path
+
+    def put(self, key, wav_path):
+        """ Copy wav_path into the cache under key and return the cached path. """
+        dest = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        os.close(fd)
+        shutil.copyfile(wav_path, tmp_path)
+        os.replace(tmp_path, dest)
+        self._evict(keep=dest)
+        return dest
+
+    def _evict(self, keep):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if not entry.name.endswith(".wav"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            sentence_hits, sentence_misses = self.sentence_hits, self.sentence_misses
+        count, total = 0, 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".wav"):
+                try:
+                    total += entry.stat().st_size
+                    count += 1
+                except FileNotFoundError:
+                    pass
+        return {"hits": hits, "misses": misses, "sentence_hits": sentence_hits, "sentence_misses": sentence_misses, "entries": count, "bytes": total, "max_bytes": self.max_bytes}
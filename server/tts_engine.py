@@ -0,0 +1,228 @@
+"""
+Sentence-level text-to-speech.
+
+A script is split into sentences which are synthesized in parallel by a pool of
+worker processes, each holding its own copy of the TTS model. Every sentence is
+looked up in (and written to) the TTSCache on its own, so edited scripts only
+re-synthesize the sentences that changed. Sentences are joined with a fixed
+pause, and stream() yields the PCM of each sentence as soon as it and all the
+sentences before it are ready. Sentences are kept at a fixed gain so their relative
+loudness survives the join; synthesize_to_file() peak-normalizes the stitched script once.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+import os, re, tempfile, threading, wave
+
+from lazy import lazy_import
+
+np = lazy_import("numpy")
+
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", max(1, min(4, (os.cpu_count() or 2) // 2))))
+TTS_SENTENCE_PAUSE = float(os.environ.get("TTS_SENTENCE_PAUSE", 0.25))
+
+# part of every whole-script cache key: bump it whenever split_sentences() changes what it returns
+SPLITTER_VERSION = 1
+# split on whitespace after sentence punctuation, keeping a closing quote/bracket with its sentence
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+|(?<=[.!?;:][\"')\]])\s+")
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+def load_tts(model_name):
+    """ Load a Coqui TTS model without precomputing the mel basis / STFT it never uses for synthesis. """
+    from TTS.api import TTS
+    from TTS.utils.audio import processor
+
+    if not getattr(processor.AudioProcessor.__init__, "_fast_load", False):
+        _original_init = processor.AudioProcessor.__init__
+
+        def fast_load_init(self, *args, fast_load=True, **kwargs):
+            self.fast_load = fast_load
+            _original_init(self, *args, **kwargs)
+            if self.fast_load:
+                self.mel_basis = None
+                self.stft = None
+
+        fast_load_init._fast_load = True
+        processor.AudioProcessor.__init__ = fast_load_init
+    return TTS(model_name=model_name, progress_bar=False, gpu=False)
+
+
+def to_pcm16(wav):
+    """ Float waveform in [-1, 1] -> int16 at a fixed gain (no per-sentence normalization). """
+    wav = np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0)
+    return (wav * 32767).astype(np.int16)
+
+
+def normalize_peak(pcm):
+    """ int16 audio scaled to full scale the way TTS.save_wav does it, over everything passed in. """
+    peak = float(np.max(np.abs(pcm.astype(np.float32)))) if pcm.size else 0.0
+    return (pcm.astype(np.float32) * (32767 / max(0.01 * 32767, peak))).astype(np.int16)
+
+
+def write_wav(path, pcm, sample_rate):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16), f.getframerate()
+
+
+# === Worker process side ===
+_worker_tts = None
+
+
+def _init_tts_worker(model_name, torch_threads):
+    global _worker_tts
+    import torch
+    # every worker would otherwise use all cores and they would fight each other
+    torch.set_num_threads(torch_threads)
+    _worker_tts = load_tts(model_name)
+
+
+def _synthesize(sentence):
+    wav = _worker_tts.tts(text=sentence)
+    return np.asarray(wav, dtype=np.float32), _worker_tts.synthesizer.output_sample_rate
+
+
+# === Server side ===
+class TTSEngine():
+    def __init__(self, model_name, cache=None, workers=TTS_WORKERS, pause=TTS_SENTENCE_PAUSE):
+        self.model_name = model_name
+        self.cache = cache
+        self.workers = workers
+        self.pause = pause
+        self.sample_rate = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                print(f"[TTS] Starting {self.workers} synthesis worker(s) for {self.model_name}")
+                torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=mp.get_context("spawn"),
+                    initializer=_init_tts_worker,
+                    initargs=(self.model_name, torch_threads),
+                )
+            return self._pool
+
+    def _restart(self, broken):
+        """ Drop a pool whose worker died (crash / OOM kill); the next _executor() starts a new one. """
+        with self._lock:
+            if self._pool is broken:
+                print("[TTS] A synthesis worker died; restarting the worker pool")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _submit(self, sentence):
+        """ (pool, future) of one sentence, on a fresh pool if the current one is already broken. """
+        pool = self._executor()
+        try:
+            return pool, pool.submit(_synthesize, sentence)
+        except BrokenProcessPool:
+            self._restart(pool)
+            pool = self._executor()
+            return pool, pool.submit(_synthesize, sentence)
+
+    def warmup(self):
+        """ Start every worker (loading the model) and run one tiny synthesis through each. """
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                for wav, sample_rate in pool.map(_synthesize, ["Hello."] * self.workers):
+                    self.sample_rate = sample_rate
+                return self.sample_rate
+            except BrokenProcessPool:
+                self._restart(pool)
+                if attempt:
+                    raise
+
+    def _cached(self, sentence):
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(sentence, self.model_name, kind="sentence", gain="fixed")
+        path = self.cache.get(key, sentence=True)
+        return key, (read_wav(path) if path else None)
+
+    def _store(self, key, pcm, sample_rate):
+        if self.cache is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            write_wav(tmp_path, pcm, sample_rate)
+            self.cache.put(key, tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def iter_sentences(self, text):
+        """
+        Yield (sentence, int16 pcm, sample_rate) in script order. All uncached sentences
+        are submitted at once; each is yielded as soon as it and its predecessors are done.
+        If a worker dies, the sentences still outstanding are resubmitted once to a new pool.
+        """
+        sentences = split_sentences(text)
+        pending = []
+        for sentence in sentences:
+            key, hit = self._cached(sentence)
+            pool, future = self._submit(sentence) if hit is None else (None, None)
+            pending.append([sentence, key, hit, pool, future])
+
+        retried = False
+        for i, (sentence, key, hit, pool, future) in enumerate(pending):
+            if hit is not None:
+                pcm, sample_rate = hit
+            else:
+                try:
+                    wav, sample_rate = future.result()
+                except BrokenProcessPool:
+                    if retried:
+                        raise
+                    retried = True
+                    self._restart(pool)
+                    for entry in pending[i:]:
+                        # sentences the old pool had already finished are kept
+                        if entry[3] is pool and (entry[4].cancelled() or not entry[4].done() or entry[4].exception()):
+                            entry[3], entry[4] = self._submit(entry[0])
+                    wav, sample_rate = pending[i][4].result()
+                pcm = to_pcm16(wav)
+                self._store(key, pcm, sample_rate)
+            self.sample_rate = sample_rate
+            yield sentence, pcm, sample_rate
+
+    def stream(self, text):
+        """ Yield (int16 pcm, sample_rate) chunks of the full script, pauses included. """
+        first = True
+        for _, pcm, sample_rate in self.iter_sentences(text):
+            if not first and self.pause > 0:
+                yield np.zeros(int(round(self.pause * sample_rate)), dtype=np.int16), sample_rate
+            first = False
+            yield pcm, sample_rate
+
+    def synthesize_to_file(self, text, path):
+        """ Write the whole script as one mono 16-bit wav; returns the number of sentences. """
+        chunks = []
+        sample_rate = None
+        for pcm, sample_rate in self.stream(text):
+            chunks.append(pcm)
+        if not chunks:
+            raise ValueError("No sentences to synthesize")
+        write_wav(path, normalize_peak(np.concatenate(chunks)), sample_rate)
+        return len(split_sentences(text))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
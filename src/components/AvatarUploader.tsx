@@ -13,6 +13,29 @@ const preloadedAvatars = [
   "/avatars/Avatar3.png",
 ];
 
+const API_URL = "http://localhost:5001";
+
+interface AvatarResponse {
+  success: boolean;
+  path?: string;
+  pending?: boolean;
+  status_url?: string;
+}
+
+// The backend answers 202 with a status_url when background removal outlives the
+// request; poll it until the job is done and return the avatar path (null on failure)
+async function resolveAvatarPath(data: AvatarResponse): Promise<string | null> {
+  if (!data.success) return null;
+  if (!data.pending) return data.path ?? null;
+  for (;;) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const res = await fetch(`${API_URL}${data.status_url}`);
+    const status = await res.json();
+    if (!status.success) return null;
+    if (status.status === "done") return status.paths?.[0] ?? null;
+  }
+}
+
 export default function AvatarUploader() {
   const [selectedAvatar, setSelectedAvatar] = useState<string | null>(null);
   const { setAvatar } = useAvatar();
@@ -42,15 +65,15 @@ useEffect(() => {
       formData.append("avatar", file);
 
       try {
-        const res = await fetch("http://localhost:5001/upload-avatar", {
+        const res = await fetch(`${API_URL}/upload-avatar`, {
           method: "POST",
           body: formData,
         });
-        const data = await res.json();
+        const path = await resolveAvatarPath(await res.json());
 
-        if (data.success && data.path) {
-          setSelectedAvatar(data.path);
-          setAvatar(data.path);
+        if (path) {
+          setSelectedAvatar(path);
+          setAvatar(path);
           navigate("/prompt");
         } else {
           console.error("Avatar upload was not successful");
@@ -71,16 +94,16 @@ useEffect(() => {
       const formData = new FormData();
       formData.append("avatar", file);
 
-      const res = await fetch("http://localhost:5001/upload-avatar", {
+      const res = await fetch(`${API_URL}/upload-avatar`, {
         method: "POST",
         body: formData,
       });
 
-      const data = await res.json();
+      const path = await resolveAvatarPath(await res.json());
 
-      if (data.success && data.path) {
-        setSelectedAvatar(data.path);
-        setAvatar(data.path);
+      if (path) {
+        setSelectedAvatar(path);
+        setAvatar(path);
         navigate("/prompt");
       } else {
         console.error("Preloaded avatar background removal failed");
@@ -9,10 +9,12 @@ import { useMode } from "../context/ModeContext";
 export default function Generate() {
   const { prompt } = usePrompt();
   const { avatar } = useAvatar();
-  const { selectedMusic } = useSceneSettings();
+  const { selectedBackground, selectedMusic } = useSceneSettings();
   const { mode } = useMode();
 
   const [voiceoverSrc, setVoiceoverSrc] = useState<string | null>(null);
+  const [audioId, setAudioId] = useState<string | null>(null);
+  const [videoId, setVideoId] = useState<string | null>(null);
   const [videoSrc, setVideoSrc] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [loadingStep, setLoadingStep] = useState<"tts" | "video" | null>(null);
@@ -44,6 +46,8 @@ export default function Generate() {
     setError(null);
     setLoadingStep(null);
     setVoiceoverSrc(null);
+    setAudioId(null);
+    setVideoId(null);
     setVideoSrc(null);
   };
 
@@ -74,7 +78,8 @@ export default function Generate() {
         const data = await response.json();
 
         if (response.ok && data.success) {
-          setVoiceoverSrc("http://localhost:5001/audio/output.wav");
+          setAudioId(data.audio);
+          setVoiceoverSrc(`http://localhost:5001${data.url}`);
           setLoadingStep("video");
 
           if (musicRef.current) fadeVolume(musicRef.current, 1, 0.2, 500);
@@ -92,7 +97,7 @@ export default function Generate() {
 
   // 🎞️ Generate lip-synced video — only if NOT demo mode
   useEffect(() => {
-    if (mode === "demo" || !voiceoverSrc || !avatar) return;
+    if (mode === "demo" || !voiceoverSrc || !audioId || !avatar) return;
 
     const generateVideo = async () => {
       try {
@@ -103,13 +108,16 @@ export default function Generate() {
           body: JSON.stringify({
             avatar: avatar,
             mode: "full",
-            audioPath: "output.wav",
+            audio: audioId,
+            background: selectedBackground,
+            music: selectedMusic,
           }),
         });
 
         const data = await response.json();
 
         if (response.ok && data.success && data.video_path) {
+          setVideoId(data.video);
           setVideoSrc(`http://localhost:5001${data.video_path}`);
           setLoadingStep(null);
         } else {
@@ -122,7 +130,7 @@ export default function Generate() {
     };
 
     generateVideo();
-  }, [voiceoverSrc, avatar, mode]);
+  }, [voiceoverSrc, audioId, avatar, mode]);
 
   const handleRetry = () => {
     resetState();
@@ -173,12 +181,12 @@ export default function Generate() {
                   loop
                   style={{ width: "100%", borderRadius: "10px" }}
                 />
-                {mode !== "demo" && (
+                {mode !== "demo" && videoId && (
                   <div className="mt-3">
                     <Button
                       as="a"
                       variant="success"
-                      href="http://localhost:5001/download-video"
+                      href={`http://localhost:5001/download-video/${videoId}`}
                       download
                     >
                       Download Video